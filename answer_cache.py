@@ -0,0 +1,134 @@
+import copy
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+import numpy as np
+from query_cache import normalize_query
+
+NEGATIONS = frozenset({"not", "no", "never", "without", "neither", "nor", "none", "nothing", "non"})
+
+
+def guard_terms(question: str) -> FrozenSet[str]:
+    """
+    Numbers (years, amounts, percentages) and negations in a question. Embeddings
+    barely move when these change ("... in 2024?" vs "... in 2025?", "increase"
+    vs "did not increase"), so a semantic match must have exactly the same set.
+    """
+    text = re.sub(r"n't\b", " not", question.lower())
+    terms = set()
+    for token in re.findall(r"\d[\d,.]*%?|[a-z]+", text):
+        if token[0].isdigit():
+            terms.add(token.rstrip(",.").replace(",", ""))
+        elif token in NEGATIONS:
+            terms.add(token)
+    return frozenset(terms)
+
+
+class AnswerCache:
+    """
+    Cache of generated answers for QAEngine.
+
+    An answer is reused when the question (normalized) and the set of
+    retrieved chunk_ids match a cached entry for the same model, prompt
+    version and index version (chunk_ids restart from 0 on a rebuild). Failing an exact match, an entry built from the same chunk set
+    is reused if its question embedding is at least `similarity` cosine-close
+    ("What's the 2024 fiscal outlook?" vs "fiscal outlook for 2024"), provided
+    both questions carry the same numbers and negations (see guard_terms).
+    Entries expire after `ttl_seconds` and the least recently used are evicted
+    beyond `max_size`.
+    """
+
+    def __init__(self, namespace: str, max_size: int, ttl_seconds: float, similarity: float):
+        # namespace pins the model and prompt template version
+        self.namespace = namespace
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self._entries: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _group(self, chunk_ids: Sequence[Any], version: Optional[str]) -> Tuple:
+        return (self.namespace, version, tuple(sorted(chunk_ids, key=str)))
+
+    def _expire(self, now: float) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        expired = [key for key, entry in self._entries.items() if now - entry["created"] > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+
+    def get(
+        self,
+        question: str,
+        chunk_ids: Sequence[Any],
+        question_vector: Optional[List[float]] = None,
+        version: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        group = self._group(chunk_ids, version)
+        key = group + (normalize_query(question),)
+        with self._lock:
+            self._expire(time.time())
+            entry = self._entries.get(key)
+            kind = "exact"
+
+            if entry is None and question_vector is not None and 0 < self.similarity <= 1:
+                query = np.asarray(question_vector, dtype=np.float32)
+                guard = guard_terms(question)
+                best_score = self.similarity
+                for candidate_key, candidate in self._entries.items():
+                    if candidate_key[:2] != group or candidate["vector"] is None or candidate["guard"] != guard:
+                        continue
+                    score = float(np.dot(query, candidate["vector"]) /
+                                  (np.linalg.norm(query) * np.linalg.norm(candidate["vector"]) or 1.0))
+                    if score >= best_score:
+                        best_score, entry, key, kind = score, candidate, candidate_key, "semantic"
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.semantic_hits += kind == "semantic"
+            result = copy.deepcopy(entry["result"])
+        result["cached"] = kind
+        return result
+
+    def put(
+        self,
+        question: str,
+        chunk_ids: Sequence[Any],
+        question_vector: Optional[List[float]],
+        result: Dict[str, Any],
+        version: Optional[str] = None
+    ) -> None:
+        if self.max_size <= 0:
+            return
+        key = self._group(chunk_ids, version) + (normalize_query(question),)
+        entry = {
+            "created": time.time(),
+            "vector": np.asarray(question_vector, dtype=np.float32) if question_vector is not None else None,
+            "guard": guard_terms(question),
+            "result": copy.deepcopy(result)
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
@@ -3,6 +3,7 @@ import re
 import time
 from vector_store import VectorStoreManager
 from llm_qa import QAEngine
+import metrics
 import config
 
 # ==========================================
@@ -17,7 +18,7 @@ st.set_page_config(
 
 def clean_citation_text(text):
     """Cleans raw chunk text for better readability."""
-    text = re.sub(r'###\s*[A-Z\s]+', '', text)
+    text = re.sub(r'###[^\n]*', '', text)
     text = text.replace('|', ' ').replace('---', '')
     text = text.replace('</div>', '').replace('<div>', '')
     text = " ".join(text.split())
@@ -55,8 +56,12 @@ def load_resources():
         manager = VectorStoreManager()
         # Force reload of retriever to ensure connection is fresh
         retriever = manager.get_retriever()
-        qa_engine = QAEngine()
-        return {'retriever': retriever, 'qa_engine': qa_engine}
+        qa_engine = QAEngine(
+            table_index=manager.table_index,
+            embed_query=manager.embed_query,
+            index_version=lambda: manager.manifest.get("version")
+        )
+        return {'retriever': retriever, 'qa_engine': qa_engine, 'manager': manager}
     except Exception as e:
         st.error(f"Failed to load resources: {e}")
         return None
@@ -76,6 +81,44 @@ def main():
         st.markdown("### 🟢 System Status")
         if resources:
             st.markdown(f"<div style='font-size:0.85rem; color:#8b949e; margin-bottom:1rem;'>Connected to <strong>{config.VECTOR_STORE_PATH.name}</strong></div>", unsafe_allow_html=True)
+            # Query caches are shared by every session of this server process
+            cache_stats = resources['manager'].query_cache.stats()
+            st.markdown(
+                f"<div style='font-size:0.8rem; color:#8b949e; margin-bottom:1rem;'>Query cache hit rate: "
+                f"{cache_stats['query_embeddings']['hit_rate']:.0%} embeddings · "
+                f"{cache_stats['query_results']['hit_rate']:.0%} results · "
+                f"{resources['qa_engine'].answer_cache.stats()['hit_rate']:.0%} answers</div>",
+                unsafe_allow_html=True
+            )
+            # Identical questions asked at the same time by different sessions share one run
+            st.markdown(
+                f"<div style='font-size:0.8rem; color:#8b949e; margin-bottom:1rem;'>Coalesced requests: "
+                f"{resources['manager'].flights.coalesced} retrievals · "
+                f"{resources['qa_engine'].flights.coalesced} answers</div>",
+                unsafe_allow_html=True
+            )
+            # Stage latencies of this server process (all sessions), to see where the p99 goes
+            with st.expander("⏱️ Stage Latency", expanded=False):
+                latency = metrics.REGISTRY.summary()
+                if latency:
+                    st.dataframe(
+                        [{
+                            "stage": row["stage"],
+                            "count": row["count"],
+                            **{key: f"{row[key] * 1000:.0f} ms" for key in ("p50", "p95", "p99")}
+                        } for row in latency],
+                        hide_index=True,
+                        use_container_width=True
+                    )
+                    st.download_button(
+                        "Download Prometheus metrics",
+                        data=metrics.REGISTRY.render(),
+                        file_name="rag_metrics.prom",
+                        mime="text/plain",
+                        use_container_width=True
+                    )
+                else:
+                    st.caption("No questions answered yet.")
             # Button to clear history - Critical for long sessions with small models
             if st.button("✨ New Conversation (Clear Memory)", use_container_width=True):
                 st.session_state.messages = []
@@ -96,7 +139,7 @@ def main():
                         clean_snippet = clean_citation_text(cit['snippet'])
                         st.markdown(f"""
                         <div class="citation-item">
-                            <div class="page-badge">PAGE {cit['page']}</div>
+                            <div class="page-badge">{cit['source']} · PAGE {cit['page']}</div>
                             <div class="quote-text">"{clean_snippet}"</div>
                         </div>
                         """, unsafe_allow_html=True)
@@ -111,7 +154,7 @@ def main():
         with st.chat_message("assistant"):
             placeholder = st.empty()
             try:
-                with st.spinner("Thinking..."):
+                with st.spinner("Searching the report..."):
                     if not resources:
                         st.error("Backend not loaded.")
                         st.stop()
@@ -123,14 +166,24 @@ def main():
                     # We deliberately do NOT pass chat_history to the retriever here
                     # to keep the context window clean for the 1B model.
                     docs = retriever.invoke(prompt)
-                    
-                    # 2. Generate Answer
-                    result = qa.answer_question(prompt, docs)
-                    
-                    answer = result['answer']
-                    citations = result['citations']
+
+                # 2. Stream the Answer as it is generated
+                answer = ""
+                result = None
+                for event in qa.stream_answer(prompt, docs):
+                    if event["type"] == "token":
+                        answer += event["text"]
+                        placeholder.markdown(answer + "▌")
+                    else:
+                        result = event["result"]
+
+                answer = result['answer']
+                citations = result['citations']
 
                 placeholder.markdown(answer)
+                if result.get("prompt_tokens"):
+                    st.caption(f"Prompt: ~{result['prompt_tokens']} tokens "
+                               f"({result['context_tokens_saved']} context tokens trimmed)")
                 
                 if citations:
                     with st.expander("🔎 View Evidence", expanded=True):
@@ -140,7 +193,7 @@ def main():
                             clean_snippet = clean_citation_text(cit['snippet'])
                             st.markdown(f"""
                             <div class="citation-item">
-                                <div class="page-badge">PAGE {cit['page']}</div>
+                                <div class="page-badge">{cit['source']} · PAGE {cit['page']}</div>
                                 <div class="quote-text">"{clean_snippet}"</div>
                             </div>
                             """, unsafe_allow_html=True)
@@ -151,6 +204,8 @@ def main():
                     "content": answer,
                     "citations": citations
                 })
+                if config.METRICS_FILE:
+                    metrics.REGISTRY.write(config.METRICS_FILE)
                 
             except Exception as e:
                 st.error("I ran into a momentary issue. Please try asking again!")
@@ -0,0 +1,212 @@
+import json
+import mmap
+import os
+import shutil
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+class ChunkStore:
+    """
+    Lazily-read docstore for indexes whose FAISS IDs are chunk_ids.
+
+    Files (next to index.faiss):
+        chunks.bin        - UTF-8 JSON records {"page_content", "metadata"}, back to back
+        chunks.idx.npy    - int64 columns of shape (4, n): chunk_id (sorted), offset,
+                            length and document code
+        chunks.docs.json  - [[source, doc_id], ...] indexed by document code
+
+    Only the ID/offset columns (memory-mapped) and the small document table
+    live in memory; page text and full metadata are read from the mapped
+    chunks.bin on demand, i.e. only for the top-k hits. Worker processes share
+    the mapped pages through the OS cache. Implements the Docstore
+    search/add/delete interface used by LangChain's FAISS wrapper.
+
+    Writes are staged: add/delete update the in-memory columns and append to
+    the data file, and flush(path) writes a complete copy of the store into a
+    new directory (see VectorStoreManager._save_to_disk), so readers of the
+    old files are never disturbed. A store opened with create=True writes a
+    fresh data file; otherwise the append-only data file is shared with the
+    new directory by a hard link. An opened store maps its data file right
+    away, so it keeps working after an old directory is deleted.
+    """
+
+    DATA_NAME = "chunks.bin"
+    INDEX_NAME = "chunks.idx.npy"
+    DOCS_NAME = "chunks.docs.json"
+
+    def __init__(self, path: Path, create: bool = False):
+        self.path = Path(path)
+        self._create = create
+        self._data_path = self.path / (self.DATA_NAME + ".tmp" if create else self.DATA_NAME)
+        self._data = None
+        self._writer = None
+        self._pending: List[Tuple[int, int, int, int]] = []
+
+        if create:
+            self._columns = np.empty((4, 0), dtype=np.int64)
+            self._docs: List[List[str]] = []
+            open(self._data_path, 'wb').close()
+        else:
+            self._columns = np.load(self.path / self.INDEX_NAME, mmap_mode='r')
+            with open(self.path / self.DOCS_NAME, 'r', encoding='utf-8') as f:
+                self._docs = json.load(f)
+            if self._data_path.stat().st_size:
+                self._map_data()
+        self._doc_codes = {tuple(doc): code for code, doc in enumerate(self._docs)}
+
+    @classmethod
+    def exists(cls, path: Path) -> bool:
+        path = Path(path)
+        return all((path / name).exists() for name in (cls.DATA_NAME, cls.INDEX_NAME, cls.DOCS_NAME))
+
+    # ---- reads -------------------------------------------------------------
+
+    @property
+    def chunk_ids(self) -> np.ndarray:
+        """Sorted chunk_ids present in the store."""
+        self._merge_pending()
+        return self._columns[0]
+
+    def _position(self, chunk_id: int) -> int:
+        ids = self.chunk_ids
+        pos = int(np.searchsorted(ids, chunk_id))
+        if pos < len(ids) and ids[pos] == chunk_id:
+            return pos
+        return -1
+
+    def __contains__(self, chunk_id: int) -> bool:
+        return self._position(chunk_id) >= 0
+
+    def __len__(self) -> int:
+        return len(self._columns[0]) + len(self._pending)
+
+    def _read(self, offset: int, length: int) -> bytes:
+        if self._writer is not None:
+            self._writer.flush()
+        # (Re)map lazily; the data file only ever grows while it is open
+        if self._data is None or offset + length > len(self._data):
+            self._map_data()
+        return self._data[offset:offset + length]
+
+    def _map_data(self) -> None:
+        if self._data is not None:
+            self._data.close()
+        with open(self._data_path, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def search(self, search: str) -> Union[Document, str]:
+        pos = self._position(int(search))
+        if pos < 0:
+            return f"ID {search} not found."
+        record = json.loads(self._read(int(self._columns[1, pos]), int(self._columns[2, pos])))
+        return Document(page_content=record["page_content"], metadata=record["metadata"])
+
+    def find(self, source: str) -> List[int]:
+        """chunk_ids of every chunk whose source file name or doc_id equals `source`."""
+        codes = [code for code, (doc_source, doc_id) in enumerate(self._docs) if source in (doc_source, doc_id)]
+        self._merge_pending()
+        mask = np.isin(self._columns[3], codes)
+        return self._columns[0][mask].tolist()
+
+    # ---- writes ------------------------------------------------------------
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        """Appends documents keyed by str(chunk_id)."""
+        if self._writer is None:
+            self._writer = open(self._data_path, 'ab')
+        offset = self._writer.tell()
+
+        for chunk_id, doc in texts.items():
+            record = json.dumps(
+                {"page_content": doc.page_content, "metadata": doc.metadata}, ensure_ascii=False
+            ).encode("utf-8")
+            self._writer.write(record)
+
+            doc_key = (doc.metadata.get("source"), doc.metadata.get("doc_id"))
+            if doc_key not in self._doc_codes:
+                self._doc_codes[doc_key] = len(self._docs)
+                self._docs.append(list(doc_key))
+
+            self._pending.append((int(chunk_id), offset, len(record), self._doc_codes[doc_key]))
+            offset += len(record)
+
+    def delete(self, ids: List[str]) -> None:
+        """Drops chunks from the ID columns; their bytes are reclaimed on the next full rebuild."""
+        self._merge_pending()
+        keep = ~np.isin(self._columns[0], np.asarray([int(i) for i in ids], dtype=np.int64))
+        self._columns = self._columns[:, keep]
+
+    def _merge_pending(self) -> None:
+        if not self._pending:
+            return
+        columns = np.concatenate([np.asarray(self._columns), np.asarray(self._pending, dtype=np.int64).T], axis=1)
+        # chunk_ids are handed out in increasing order, so this is normally a no-op
+        if np.any(np.diff(columns[0]) < 0):
+            columns = columns[:, np.argsort(columns[0], kind="stable")]
+        self._columns = np.ascontiguousarray(columns)
+        self._pending = []
+
+    def flush(self, path: Optional[Path] = None) -> None:
+        """
+        Makes every staged add/delete durable. With path (a new, empty directory)
+        the store is written there and the files current readers use are left
+        alone; the store then lives in path. Without it the files are replaced
+        in place, offsets and document table before the data they point into.
+        """
+        self._merge_pending()
+        if self._writer is not None:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            self._writer.close()
+            self._writer = None
+
+        target = Path(path) if path else self.path
+        index_tmp = target / (self.INDEX_NAME + ".tmp")
+        with open(index_tmp, 'wb') as f:
+            np.save(f, np.asarray(self._columns))
+        docs_tmp = target / (self.DOCS_NAME + ".tmp")
+        with open(docs_tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._docs, f, ensure_ascii=False)
+        os.replace(index_tmp, target / self.INDEX_NAME)
+        os.replace(docs_tmp, target / self.DOCS_NAME)
+
+        final_path = target / self.DATA_NAME
+        if self._data_path != final_path:
+            if self._create:
+                os.replace(self._data_path, final_path)
+            else:
+                # Records are only ever appended, so both directories can share the bytes
+                try:
+                    os.link(self._data_path, final_path)
+                except OSError:
+                    shutil.copyfile(self._data_path, final_path)
+            self._data_path = final_path
+        self.path = target
+        self._create = False
+
+
+class ChunkIdMap(Mapping):
+    """
+    index_to_docstore_id for indexes whose FAISS IDs are chunk_ids: maps
+    chunk_id -> str(chunk_id) against the live ChunkStore, without holding a
+    Python dict of every ID.
+    """
+
+    def __init__(self, store: ChunkStore):
+        self._store = store
+
+    def __getitem__(self, chunk_id: int) -> str:
+        if chunk_id in self._store:
+            return str(chunk_id)
+        raise KeyError(chunk_id)
+
+    def __iter__(self) -> Iterator[int]:
+        return (int(chunk_id) for chunk_id in self._store.chunk_ids)
+
+    def __len__(self) -> int:
+        return len(self._store)
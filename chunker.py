@@ -0,0 +1,243 @@
+import re
+from typing import List, Dict, Any, Tuple
+
+import config
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+# "1.", "2.3", "A.", "IV)" ... followed by the heading title
+_NUMBERED_HEADING = re.compile(r"^(?:\d{1,2}(?:\.\d{1,2})*\.?|[A-Z]\.|[IVX]{1,5}\.|\(?[A-Za-z0-9]{1,3}\))\s+([A-Z].*)$")
+# Lower-case words allowed inside a Title Case heading
+_TITLE_SMALL_WORDS = {
+    "a", "an", "and", "as", "at", "by", "for", "from", "in", "into", "of", "on", "or",
+    "over", "the", "to", "vs", "with"
+}
+
+
+def count_tokens(text: str) -> int:
+    """
+    Approximate token count (words and punctuation marks). Close enough to
+    WordPiece/BPE counts to budget chunks and prompts without loading a tokenizer.
+    """
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+def markdown_table_rows(text: str) -> List[List[str]]:
+    """Cells of every Markdown table row in `text` (separator rows skipped)."""
+    rows = []
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line.startswith("|"):
+            continue
+        cells = [cell.strip() for cell in line.strip("|").split("|")]
+        if cells and all(set(cell) <= {"-", ":"} and cell for cell in cells):
+            continue
+        rows.append(cells)
+    return rows
+
+
+class PageChunker:
+    """
+    Splits a page-level chunk from DocumentProcessor into sub-page chunks.
+
+    - Token-budgeted: every chunk stays under max_tokens (approximate).
+    - Heading-aware: splits at '### ' section headings and at heading lines in
+      the extracted text ("A. Recent Developments", "1. Outlook and Risks",
+      ALL-CAPS or Title Case titles), and repeats the heading at the top of
+      each chunk so the section context is never lost.
+    - Table-preserving: Markdown tables are never cut mid-row; an oversized
+      table is split by rows with its header repeated in every part.
+    - Overlapping: the trailing text lines of a chunk (up to overlap_tokens)
+      are carried into the next chunk of the same section.
+    """
+
+    def __init__(self, max_tokens: int = None, overlap_tokens: int = None):
+        self.max_tokens = config.CHUNK_MAX_TOKENS if max_tokens is None else max_tokens
+        overlap_tokens = config.CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+        # Overlap must leave room for new content or packing would never advance
+        self.overlap_tokens = min(overlap_tokens, self.max_tokens // 2)
+
+    @staticmethod
+    def _is_heading(line: str, after_break: bool) -> bool:
+        """
+        Whether a line of extracted text is a section heading: short, no trailing
+        sentence punctuation, no figures, and either numbered/lettered, ALL CAPS or
+        Title Case. Title Case alone is weak evidence (a wrapped line of a proper
+        noun looks the same), so it only counts right after a finished sentence.
+        """
+        line = line.strip()
+        words = line.split()
+        if not words or len(words) > config.CHUNK_HEADING_MAX_WORDS or line[-1] in ".,;:":
+            return False
+        numbered = _NUMBERED_HEADING.match(line)
+        title = numbered.group(1) if numbered else line
+        title_words = title.split()
+        # Figures outside the numbering prefix mean a table row or a sentence fragment
+        if any(ch.isdigit() for ch in title) or not any(ch.isalpha() for ch in title):
+            return False
+        if numbered:
+            return True
+        letters = [ch for ch in title if ch.isalpha()]
+        if len(letters) >= 4 and all(ch.isupper() for ch in letters):
+            return True
+        title_case = all(
+            word[0].isupper() or word.lower() in _TITLE_SMALL_WORDS or not word[0].isalpha()
+            for word in title_words
+        )
+        return after_break and title_case and len(title_words) >= 2 and title_words[0][0].isupper()
+
+    def _sections(self, content: str) -> List[Tuple[str, List[Tuple[str, str]]]]:
+        """Parses page content into [(heading, [(kind, text), ...])] with kind 'line' or 'table'."""
+        sections = [("", [])]
+        table_lines: List[str] = []
+        after_break = True  # previous text line ended a sentence (or there was none)
+
+        def close_table():
+            if table_lines:
+                sections[-1][1].append(("table", "\n".join(table_lines)))
+                table_lines.clear()
+
+        for line in content.split("\n"):
+            if line.startswith("|"):
+                table_lines.append(line)
+                continue
+            close_table()
+            if line.startswith("### "):
+                sections.append((line, []))
+                after_break = True
+            elif self._is_heading(line, after_break):
+                sections.append((line.strip(), []))
+                after_break = True
+            elif line.strip():
+                sections[-1][1].append(("line", line))
+                after_break = line.rstrip()[-1] in ".?!:"
+        close_table()
+
+        parsed = []
+        for heading, units in sections:
+            if units:
+                parsed.append((heading, units))
+            elif heading and not heading.startswith("### "):
+                # A detected heading with nothing under it (last line of the page,
+                # a running footer) stays in the text instead of vanishing
+                if parsed:
+                    parsed[-1][1].append(("line", heading))
+                else:
+                    parsed.append(("", [("line", heading)]))
+        return parsed
+
+    @staticmethod
+    def _split_words(text: str, budget: int) -> List[str]:
+        pieces, current = [], []
+        for word in text.split(" "):
+            if current and count_tokens(" ".join(current + [word])) > budget:
+                pieces.append(" ".join(current))
+                current = []
+            current.append(word)
+        if current:
+            pieces.append(" ".join(current))
+        return pieces
+
+    def _split_oversized(self, kind: str, text: str, budget: int) -> List[Tuple[str, str]]:
+        """Breaks a single unit that exceeds the budget into budget-sized pieces."""
+        if count_tokens(text) <= budget:
+            return [(kind, text)]
+        if kind == "line":
+            return [("line", piece) for piece in self._split_words(text, budget)]
+
+        rows = text.split("\n")
+        header, body = rows[:2], rows[2:]
+        if count_tokens("\n".join(header)) > budget // 2:
+            header = []
+        pieces, current = [], []
+
+        def close():
+            if current:
+                pieces.append(("table", "\n".join(header + current)))
+                current.clear()
+
+        for row in body:
+            if count_tokens("\n".join(header + [row])) > budget:
+                # pdfplumber sometimes merges a whole table into one row; last resort
+                close()
+                pieces.extend(("table", piece) for piece in self._split_words(row, budget))
+                continue
+            if current and count_tokens("\n".join(header + current + [row])) > budget:
+                close()
+            current.append(row)
+        close()
+        return pieces
+
+    def _overlap_tail(self, units: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """Trailing text lines (never tables) that fit in the overlap budget."""
+        tail, tokens = [], 0
+        for kind, text in reversed(units):
+            unit_tokens = count_tokens(text)
+            if kind != "line" or tokens + unit_tokens > self.overlap_tokens:
+                break
+            tail.insert(0, (kind, text))
+            tokens += unit_tokens
+        return tail
+
+    def split(self, chunk: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Returns the sub-page chunks for one page-level chunk (in reading order)."""
+        content = chunk["page_content"]
+        if self.max_tokens <= 0 or count_tokens(content) <= self.max_tokens:
+            parts = [content]
+        else:
+            parts = []
+            for heading, units in self._sections(content):
+                budget = max(self.max_tokens - count_tokens(heading), 1)
+                current: List[Tuple[str, str]] = []
+                fresh = False  # whether `current` holds anything beyond the carried overlap
+                for kind, text in units:
+                    for piece in self._split_oversized(kind, text, budget):
+                        piece_tokens = count_tokens(piece[1])
+                        current_tokens = sum(count_tokens(t) for _, t in current)
+                        if fresh and current_tokens + piece_tokens > budget:
+                            parts.append(self._render(heading, current))
+                            current = self._overlap_tail(current)
+                            # Drop the overlap if it can't share a chunk with the next piece
+                            if sum(count_tokens(t) for _, t in current) + piece_tokens > budget:
+                                current = []
+                        current.append(piece)
+                        fresh = True
+                if fresh:
+                    parts.append(self._render(heading, current))
+            parts = self._merge_small(parts)
+
+        page = chunk["metadata"]["page"]
+        sub_chunks = []
+        for i, part in enumerate(parts):
+            metadata = dict(chunk["metadata"])
+            metadata.update({
+                "page_start": page,
+                "page_end": page,
+                "chunk_index": i,
+                "chunks_on_page": len(parts),
+                "token_count": count_tokens(part),
+                "has_tables": "\n|" in f"\n{part}",
+                "has_images": "[IMAGE_REF:" in part,
+            })
+            if metadata.get("chunk_type") == "table" and len(parts) > 1:
+                # Each part of a split table only describes the rows it holds
+                rows = markdown_table_rows(part)
+                if rows and rows[0] == metadata.get("columns"):
+                    rows = rows[1:]
+                metadata["row_headers"] = [row[0] for row in rows if row and row[0]]
+            sub_chunks.append({"page_content": part, "metadata": metadata})
+        return sub_chunks
+
+    def _merge_small(self, parts: List[str]) -> List[str]:
+        """Packs neighbouring short sections (e.g. a one-line caption) back together."""
+        merged = []
+        for part in parts:
+            if merged and count_tokens(merged[-1]) + count_tokens(part) <= self.max_tokens:
+                merged[-1] = f"{merged[-1]}\n{part}"
+            else:
+                merged.append(part)
+        return merged
+
+    @staticmethod
+    def _render(heading: str, units: List[Tuple[str, str]]) -> str:
+        body = "\n".join(text if kind == "line" else f"\n{text}\n" for kind, text in units)
+        return f"{heading}\n{body}\n" if heading else f"{body}\n"
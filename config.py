@@ -16,7 +16,9 @@ PDF_PATH = RAW_DATA_DIR / "qatar_test_doc.pdf"
 
 # Output/Processed paths
 PROCESSED_DATA_DIR = DATA_DIR / "processed"
-CHUNKS_PATH = PROCESSED_DATA_DIR / "extracted_chunks.json"
+CHUNKS_PATH = PROCESSED_DATA_DIR / "extracted_chunks.jsonl"
+# Per-page extraction cache, keyed by content-stream hash + extractor version
+PAGE_CACHE_DIR = PROCESSED_DATA_DIR / "page_cache"
 
 IMAGES_DIR = DATA_DIR / "images"
 
@@ -24,6 +26,10 @@ IMAGES_DIR = DATA_DIR / "images"
 VECTOR_STORE_DIR = DATA_DIR / "vector_store"
 # CRITICAL: This variable must be defined globally, outside any if/else blocks
 VECTOR_STORE_PATH = VECTOR_STORE_DIR / "faiss_index"
+# Chunk-hash -> embedding cache (memory-mapped float32 rows), one folder per model
+EMBEDDING_CACHE_DIR = VECTOR_STORE_DIR / "embedding_cache"
+# Optional on-disk backing for the query embedding / top-k caches
+QUERY_CACHE_PATH = VECTOR_STORE_DIR / "query_cache.sqlite"
 
 # Ensure directories exist
 directories = [
@@ -38,6 +44,22 @@ for directory in directories:
     directory.mkdir(parents=True, exist_ok=True)
 
 
+# ==========================================
+# 📄 INGESTION CONFIGURATION
+# ==========================================
+
+# Worker processes used to extract PDF pages (1 = serial, in-process)
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "1"))
+
+# Sub-page chunking: approximate token budget per chunk (0 = one chunk per page)
+# and tokens of trailing text repeated at the start of the next chunk.
+# MiniLM truncates its input at 256 word pieces, so larger chunks lose text.
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "220"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+# Longest line (in words) the chunker still treats as a section heading
+CHUNK_HEADING_MAX_WORDS = int(os.getenv("CHUNK_HEADING_MAX_WORDS", "12"))
+
+
 # ==========================================
 # 🧠 MODEL CONFIGURATION
 # ==========================================
@@ -50,18 +72,132 @@ DEPLOYMENT_MODE = os.getenv("DEPLOYMENT_MODE", "local")
 if DEPLOYMENT_MODE == "local":
     LLM_MODEL_NAME = "llama3.2:1b"
     OLLAMA_BASE_URL = "http://localhost:11434"
+    # Several Ollama servers (comma-separated) share the load; see llm_clients.BackendRouter
+    OLLAMA_BASE_URLS = [url.strip() for url in os.getenv("OLLAMA_BASE_URLS", OLLAMA_BASE_URL).split(",") if url.strip()]
     GROQ_API_KEY = None
 else:
     # Cloud Mode (Streamlit Cloud)
     # Uses Groq for fast, free inference of Llama models
     LLM_MODEL_NAME = "llama-3.1-8b-instant"
     OLLAMA_BASE_URL = None
+    OLLAMA_BASE_URLS = []
     GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
+# HTTP connection pool shared by every QAEngine (per process): keep-alive
+# connections to the LLM backend, timeouts in seconds, and retries with
+# exponential backoff (LLM_RETRY_BACKOFF * 2^attempt) on transient failures
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "8"))
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", "300"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+# A backend silent for LLM_READ_TIMEOUT is considered stalled and failed over
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+# Seconds a failed Ollama backend gets no traffic before it is health-checked again
+LLM_BACKEND_COOLDOWN_SECONDS = float(os.getenv("LLM_BACKEND_COOLDOWN_SECONDS", "30"))
+
 # 2. Embedding Settings
 # We use the same embedding model for both (it runs on CPU)
 EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 EMBEDDING_DEVICE = "cpu"
+# Chunks per forward pass; chunks are length-sorted so each batch pads evenly
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+# Intra-op (torch) threads for the embedding model; 0 keeps the library default
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+
+# Chunks embedded and appended to the index per step while streaming the JSONL
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "256"))
+
+# 3. Vector Index Settings
+# FAISS index family: "flat" (exact), "ivf" (trained centroids), "hnsw" (graph)
+# or "ivfpq" (IVF + product quantization, smallest memory footprint)
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+# Vectors buffered to train IVF centroids / PQ codebooks before indexing starts
+FAISS_TRAIN_SIZE = int(os.getenv("FAISS_TRAIN_SIZE", "50000"))
+FAISS_IVF_NLIST = int(os.getenv("FAISS_IVF_NLIST", "1024"))
+FAISS_IVF_NPROBE = int(os.getenv("FAISS_IVF_NPROBE", "16"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_HNSW_EF_CONSTRUCTION = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "200"))
+FAISS_HNSW_EF_SEARCH = int(os.getenv("FAISS_HNSW_EF_SEARCH", "64"))
+# PQ sub-quantizers must divide the embedding dimension (384 for MiniLM)
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "48"))
+FAISS_PQ_NBITS = int(os.getenv("FAISS_PQ_NBITS", "8"))
+# Held-out sample queries for the recall@k / latency report printed after a build
+# (0 disables); each is brute-forced against every added batch during the build
+FAISS_EVAL_QUERIES = int(os.getenv("FAISS_EVAL_QUERIES", "200"))
+
+# How load_vector_store opens the index: "ram" (read + unpickle) or "mmap"
+# (memory-mapped index and chunk store, shared across worker processes;
+# flat/HNSW indexes need faiss-cpu >= 1.11, older builds map IVF indexes only)
+INDEX_LOAD_MODE = os.getenv("INDEX_LOAD_MODE", "ram")
+
+# 4. Retrieval Settings
+RETRIEVAL_K = 4
+# "hybrid" fuses BM25 and dense rankings (reciprocal-rank fusion); "dense" is vector-only
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Candidates taken from each ranking before fusion
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "20"))
+# RRF damping constant: score = sum(1 / (RRF_K + rank))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Keyword queries with at most this many terms skip dense search when every
+# top-k BM25 hit contains all of the terms (0 disables the shortcut)
+SPARSE_SHORTCUT_MAX_TERMS = int(os.getenv("SPARSE_SHORTCUT_MAX_TERMS", "3"))
+
+# Optional cross-encoder rerank: over-fetch RERANK_FETCH_K candidates, score them
+# and keep the best RETRIEVAL_K that fit in RERANK_TOKEN_BUDGET context tokens
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "0") == "1"
+RERANK_MODEL_NAME = os.getenv("RERANK_MODEL_NAME", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_FETCH_K = int(os.getenv("RERANK_FETCH_K", "50"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+RERANK_TOKEN_BUDGET = int(os.getenv("RERANK_TOKEN_BUDGET", "900"))
+# Hard per-query cap; past it the raw retrieval order is used (0 = no cap)
+RERANK_LATENCY_BUDGET_MS = float(os.getenv("RERANK_LATENCY_BUDGET_MS", "300"))
 
-# 3. Retrieval Settings
-RETRIEVAL_K = 4
\ No newline at end of file
+# LRU entries for query -> embedding and query -> top-k chunk_ids (0 disables)
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+# Back the query caches with QUERY_CACHE_PATH so they survive restarts
+QUERY_CACHE_PERSIST = os.getenv("QUERY_CACHE_PERSIST", "0") == "1"
+
+# 5. Answer Cache Settings
+# Generated answers reused for the same question and retrieved chunk set (0 disables)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+# Cosine similarity at which a differently worded question over the same chunks
+# reuses a cached answer (0 = exact question matches only)
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.92"))
+
+# 6. Context Settings
+# Approximate token budget for the retrieved context in the LLM prompt; past it the
+# sentences/table rows least related to the question are dropped (0 = no limit)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1000"))
+
+
+# ==========================================
+# 🌐 SERVICE CONFIGURATION (service.py)
+# ==========================================
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8000"))
+# Questions processed at once; further requests queue for a slot
+SERVICE_MAX_CONCURRENCY = int(os.getenv("SERVICE_MAX_CONCURRENCY", "8"))
+# Threads for CPU-bound retrieval work (query embedding, FAISS, BM25, rerank)
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", "4"))
+
+# ==========================================
+# 📦 BATCH QA CONFIGURATION (run_pipeline.py --questions-file)
+# ==========================================
+# Questions retrieved together (one embedding batch + one FAISS search) per window
+BATCH_QA_WINDOW = int(os.getenv("BATCH_QA_WINDOW", "256"))
+# LLM generations in flight at once
+BATCH_QA_CONCURRENCY = int(os.getenv("BATCH_QA_CONCURRENCY", "4"))
+
+# ==========================================
+# 📈 METRICS CONFIGURATION (metrics.py)
+# ==========================================
+# Upper bounds (seconds) of the per-stage latency histogram buckets
+METRICS_BUCKETS = tuple(
+    float(bound) for bound in os.getenv(
+        "METRICS_BUCKETS", "0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60"
+    ).split(",") if bound.strip()
+)
+# Prometheus text file written at the end of each CLI run and after each answer in the app ("" = off)
+METRICS_FILE = os.getenv("METRICS_FILE", "")
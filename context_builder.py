@@ -0,0 +1,202 @@
+import re
+from typing import List, Dict, Any, Tuple
+
+from langchain_core.documents import Document
+from chunker import count_tokens
+from sparse_index import tokenize
+import config
+
+# Lines at most this long that repeat across pages are running headers/footers
+BOILERPLATE_MAX_TOKENS = 12
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(\"'])")
+
+
+def _is_table_separator(line: str) -> bool:
+    cells = [cell.strip() for cell in line.strip().strip("|").split("|")]
+    return bool(cells) and all(cell and set(cell) <= {"-", ":"} for cell in cells)
+
+
+class ContextBuilder:
+    """
+    Builds the LLM context from retrieved chunks under a token budget.
+
+    1. Deduplication: short lines that repeat on more than one page (running
+       headers and footers, page numbers ignored) and sentences already given
+       by a higher-ranked chunk (sub-chunk overlap) appear only once.
+    2. Budget: while the context is over max_tokens, the sentence or table row
+       sharing the fewest terms with the question is dropped (lower-ranked
+       chunks first on ties). Tables keep their header rows; a chunk with
+       nothing left is left out. max_tokens=0 disables pruning.
+    """
+
+    def __init__(self, max_tokens: int = None):
+        self.max_tokens = config.CONTEXT_TOKEN_BUDGET if max_tokens is None else max_tokens
+
+    @staticmethod
+    def _doc_header(doc: Document) -> str:
+        source = doc.metadata.get("source", "Report")
+        page = doc.metadata.get("page", "?")
+        return f"--- INFO FROM PAGE {page} ({source}) ---"
+
+    @staticmethod
+    def _clean(line: str) -> str:
+        return line.replace("### TEXT CONTENT", "").replace("### TABLE", "Table").strip()
+
+    @staticmethod
+    def _boilerplate_key(line: str) -> str:
+        return re.sub(r"\d+", "#", line.lower()).strip()
+
+    def _boilerplate(self, docs: List[Document]) -> set:
+        """Short non-table lines found on two or more distinct pages."""
+        pages_by_line: Dict[str, set] = {}
+        for doc in docs:
+            page = (doc.metadata.get("source"), doc.metadata.get("page"))
+            for line in doc.page_content.split("\n"):
+                line = line.strip()
+                if not line or line.startswith(("|", "###")) or count_tokens(line) > BOILERPLATE_MAX_TOKENS:
+                    continue
+                pages_by_line.setdefault(self._boilerplate_key(line), set()).add(page)
+        return {key for key, pages in pages_by_line.items() if len(pages) > 1}
+
+    def _blocks(self, content: str, boilerplate: set) -> List[Dict[str, Any]]:
+        """
+        Parses chunk content into blocks of {"head": [lines], "units": [[text, kind]]}.
+        Head lines (section headings, table header rows) are shown only while
+        at least one unit of their block is. Units are sentences of a paragraph
+        (PDF line wraps joined), table rows, or standalone boilerplate lines.
+        """
+        blocks = [{"head": [], "units": []}]
+        paragraph: List[str] = []
+
+        def close_paragraph():
+            if paragraph:
+                sentences = _SENTENCE_END.split(" ".join(paragraph))
+                blocks[-1]["units"].extend([sentence, "sentence"] for sentence in sentences[:-1])
+                # The next paragraph starts on a new output line
+                blocks[-1]["units"].append([sentences[-1], "sentence_end"])
+                paragraph.clear()
+
+        lines = [line.strip() for line in content.split("\n")]
+        for i, line in enumerate(lines):
+            if line.startswith("|"):
+                close_paragraph()
+                is_header = i + 1 < len(lines) and _is_table_separator(lines[i + 1])
+                if is_header or _is_table_separator(line):
+                    if blocks[-1]["units"]:
+                        blocks.append({"head": [], "units": []})
+                    blocks[-1]["head"].append(line)
+                else:
+                    blocks[-1]["units"].append([line, "row"])
+                continue
+            if blocks[-1]["units"] and blocks[-1]["units"][-1][1] == "row":
+                # Whatever follows a table is a new block
+                blocks.append({"head": [], "units": []})
+            if line.startswith("###"):
+                close_paragraph()
+                heading = self._clean(line)
+                blocks.append({"head": [heading] if heading else [], "units": []})
+            elif self._boilerplate_key(line) in boilerplate:
+                close_paragraph()
+                blocks[-1]["units"].append([line, "line"])
+            elif line:
+                paragraph.append(line)
+            else:
+                close_paragraph()
+        close_paragraph()
+        return [block for block in blocks if block["units"]]
+
+    def build(self, query: str, docs: List[Document]) -> Tuple[str, Dict[str, int]]:
+        """Returns (context text, stats) for the docs in retrieval order."""
+        boilerplate = self._boilerplate(docs)
+        query_terms = set(tokenize(query))
+        seen_lines, seen_sentences = set(), set()
+        original_tokens = 0
+
+        # 1. Parse every chunk and drop repeated boilerplate and sentences
+        parsed = []
+        for doc in docs:
+            header = self._doc_header(doc)
+            original_tokens += count_tokens(header) + count_tokens(self._clean(doc.page_content))
+            blocks = []
+            for block in self._blocks(doc.page_content, boilerplate):
+                units = []
+                for text, kind in block["units"]:
+                    if kind == "line":
+                        key = self._boilerplate_key(text)
+                        if key in seen_lines:
+                            continue
+                        seen_lines.add(key)
+                    elif kind != "row":
+                        if text in seen_sentences:
+                            continue
+                        seen_sentences.add(text)
+                    units.append({"text": text, "kind": kind, "tokens": count_tokens(text), "kept": True})
+                if units:
+                    blocks.append({"head": block["head"], "head_tokens": sum(count_tokens(line) for line in block["head"]), "units": units})
+            if blocks:
+                parsed.append({"header": header, "header_tokens": count_tokens(header), "blocks": blocks})
+
+        def block_tokens(block):
+            kept = [unit["tokens"] for unit in block["units"] if unit["kept"]]
+            return block["head_tokens"] + sum(kept) if kept else 0
+
+        def doc_tokens(entry):
+            tokens = sum(block_tokens(block) for block in entry["blocks"])
+            return entry["header_tokens"] + tokens if tokens else 0
+
+        total = sum(doc_tokens(entry) for entry in parsed)
+        dropped = 0
+
+        # 2. Over budget: drop the least relevant sentences/rows first
+        if self.max_tokens > 0 and total > self.max_tokens:
+            candidates = []
+            for rank, entry in enumerate(parsed):
+                for block in entry["blocks"]:
+                    for position, unit in enumerate(block["units"]):
+                        overlap = len(query_terms & set(tokenize(unit["text"])))
+                        score = overlap / len(query_terms) if query_terms else 0.0
+                        candidates.append((score, -rank, -position, entry, block, unit))
+            candidates.sort(key=lambda candidate: candidate[:3])
+
+            # The best-scoring unit always stays so the LLM gets some context
+            for _, _, _, entry, block, unit in candidates[:-1]:
+                if total <= self.max_tokens:
+                    break
+                before = doc_tokens(entry)
+                unit["kept"] = False
+                total -= before - doc_tokens(entry)
+                dropped += 1
+
+        # 3. Render
+        parts = []
+        for entry in parsed:
+            rendered_blocks = []
+            for block in entry["blocks"]:
+                kept = [unit for unit in block["units"] if unit["kept"]]
+                if not kept:
+                    continue
+                lines, sentences = list(block["head"]), []
+                for unit in kept:
+                    if unit["kind"] in ("row", "line"):
+                        if sentences:
+                            lines.append(" ".join(sentences))
+                            sentences = []
+                        lines.append(unit["text"])
+                        continue
+                    sentences.append(unit["text"])
+                    if unit["kind"] == "sentence_end":
+                        lines.append(" ".join(sentences))
+                        sentences = []
+                if sentences:
+                    lines.append(" ".join(sentences))
+                rendered_blocks.append("\n".join(lines))
+            if rendered_blocks:
+                parts.append(f"{entry['header']}\n" + "\n".join(rendered_blocks) + "\n\n")
+
+        context = "".join(parts)
+        return context, {
+            "context_tokens": total,
+            "original_context_tokens": original_tokens,
+            "dropped_units": dropped
+        }
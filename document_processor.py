@@ -1,22 +1,261 @@
 import pdfplumber
+import hashlib
 import json
+import itertools
+import math
+import os
 import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator, Callable
+from pdfminer.pdftypes import PDFObjRef, PDFStream, resolve1
 import config
+import metrics
+from chunker import PageChunker
+
+# Page shards handed to each worker; >1 smooths out uneven per-page cost
+SHARDS_PER_WORKER = 4
+
+# Bump whenever _extract_page changes its output so cached pages are re-extracted
+EXTRACTOR_VERSION = "2"
+
+
+def make_doc_id(pdf_path: Path) -> str:
+    """
+    Stable, human-readable document ID: the PDF's path relative to RAW_DATA_DIR
+    without its extension, e.g. 'gcc/qatar_2024'.
+    """
+    pdf_path = Path(pdf_path).resolve()
+    try:
+        relative = pdf_path.relative_to(config.RAW_DATA_DIR.resolve())
+    except ValueError:
+        relative = Path(pdf_path.name)
+    return relative.with_suffix("").as_posix()
+
+
+def discover_pdfs(root: Optional[Path] = None) -> List[Path]:
+    """Finds every PDF under root (default: RAW_DATA_DIR), in a stable order."""
+    root = Path(root or config.RAW_DATA_DIR)
+    return sorted(p for p in root.rglob("*") if p.is_file() and p.suffix.lower() == ".pdf")
+
+
+def _hash_pdf_object(obj: Any, digest, memo: Dict[int, bytes]) -> None:
+    """
+    Feeds a PDF object into digest, following indirect references. Each referenced
+    object is hashed once per document (memo, keyed by object id), so fonts and
+    forms shared by many pages cost nothing after the first page.
+    """
+    if isinstance(obj, PDFObjRef):
+        if obj.objid not in memo:
+            # Placeholder first, so reference cycles terminate
+            memo[obj.objid] = b"cycle"
+            sub_digest = hashlib.sha256()
+            _hash_pdf_object(obj.resolve(), sub_digest, memo)
+            memo[obj.objid] = sub_digest.digest()
+        digest.update(b"R" + memo[obj.objid])
+    elif isinstance(obj, PDFStream):
+        _hash_pdf_object(obj.attrs, digest, memo)
+        # Raw (still encoded) bytes identify the stream without decompressing it
+        data = obj.get_rawdata()
+        digest.update(b"S" + (data if data is not None else obj.get_data()))
+    elif isinstance(obj, dict):
+        digest.update(b"{")
+        for key in sorted(obj, key=str):
+            digest.update(str(key).encode() + b"=")
+            _hash_pdf_object(obj[key], digest, memo)
+        digest.update(b"}")
+    elif isinstance(obj, (list, tuple)):
+        digest.update(b"[")
+        for item in obj:
+            _hash_pdf_object(item, digest, memo)
+        digest.update(b"]")
+    else:
+        digest.update(repr(obj).encode() + b";")
+
+
+def _page_fingerprint(page, memo: Optional[Dict[int, bytes]] = None) -> str:
+    """
+    Hashes the page's content stream(s) and everything they draw with: the
+    /Resources dictionary, recursing into Form XObjects, fonts and their
+    ToUnicode maps. Two pages whose stream is just "q /Fm0 Do Q" differ
+    only there. Pass one memo per document to hash shared resources once.
+    """
+    memo = {} if memo is None else memo
+    digest = hashlib.sha256(f"{EXTRACTOR_VERSION}|{page.bbox}".encode())
+    for stream in page.page_obj.contents:
+        digest.update(resolve1(stream).get_data())
+    _hash_pdf_object(page.page_obj.resources, digest, memo)
+    return digest.hexdigest()
+
+
+def _load_cached_page(cache_dir: Path, fingerprint: str) -> Tuple[bool, List[Dict[str, Any]]]:
+    """Returns (hit, chunks). A hit may carry no chunks for pages with no content."""
+    cache_file = cache_dir / f"{fingerprint}.json"
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            return True, json.load(f)["chunks"]
+    except (OSError, ValueError, KeyError):
+        return False, []
+
+
+def _store_cached_page(cache_dir: Path, fingerprint: str, chunks: List[Dict[str, Any]]):
+    cache_file = cache_dir / f"{fingerprint}.json"
+    # Write-then-rename so concurrent workers never observe a half-written entry
+    tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({"chunks": chunks}, f, ensure_ascii=False)
+    os.replace(tmp_file, cache_file)
+
+
+def _iter_page_range(
+    pdf_path: str,
+    doc_id: str,
+    start: int = 0,
+    end: Optional[int] = None,
+    cache_dir: Optional[str] = None,
+    show_progress: bool = False
+) -> Iterator[Tuple[List[Dict[str, Any]], bool]]:
+    """
+    Yields (chunks, cache_hit) for pages [start, end) using a dedicated pdfplumber handle.
+    end=None runs to the last page. chunks holds the page's sub-page chunks in reading
+    order and is empty for pages with no usable content.
+    """
+    source = Path(pdf_path).name
+    cache_path = Path(cache_dir) if cache_dir else None
+    # Splitting runs after the cache, so changing the chunk budget never invalidates it
+    chunker = PageChunker()
+    # Resource hashes shared by the pages of this document (see _page_fingerprint)
+    fingerprint_memo: Dict[int, bytes] = {}
+
+    with pdfplumber.open(pdf_path) as pdf:
+        total_pages = len(pdf.pages)
+        for i in range(start, total_pages if end is None else end):
+            page_num = i + 1
+            if show_progress:
+                print(f"   - Processing Page {page_num}/{total_pages}...", end="\r")
+
+            page = pdf.pages[i]
+            hit = False
+            if cache_path:
+                fingerprint = _page_fingerprint(page, fingerprint_memo)
+                hit, page_chunks = _load_cached_page(cache_path, fingerprint)
+
+            if cache_path:
+                metrics.record_cache("page_cache", int(hit), int(not hit))
+            if hit:
+                # Identical pages can move or be shared across files; re-stamp location
+                for chunk in page_chunks:
+                    chunk["metadata"].update({"source": source, "doc_id": doc_id, "page": page_num})
+            else:
+                with metrics.timed("pdf_page_extraction"):
+                    page_chunks = DocumentProcessor._extract_page(page, page_num, source, doc_id)
+                if cache_path:
+                    _store_cached_page(cache_path, fingerprint, page_chunks)
+
+            # Drop pdfplumber's per-page object cache so long ranges stay flat in memory
+            page.close()
+            yield [sub_chunk for chunk in page_chunks for sub_chunk in chunker.split(chunk)], hit
+
+
+def _extract_page_range(
+    pdf_path: str, doc_id: str, start: int, end: int, cache_dir: Optional[str] = None
+) -> Tuple[List[Tuple[List[Dict[str, Any]], bool]], Dict[str, Any]]:
+    """
+    Worker entry point: extracts pages [start, end) and returns one (chunks, cache_hit) per page,
+    plus the worker's stage timings for the parent to merge.
+    Lives at module level so it can be pickled into ProcessPoolExecutor workers.
+    """
+    # Forked workers inherit the parent's registry; only report this shard's timings
+    metrics.REGISTRY.reset()
+    return list(_iter_page_range(pdf_path, doc_id, start, end, cache_dir)), metrics.REGISTRY.snapshot()
+
+
+def _extract_document(
+    pdf_path: str, doc_id: str, cache_dir: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], int, int, Dict[str, Any]]:
+    """Corpus worker entry point: extracts a whole PDF, returning (chunks, pages, cache hits, stage timings)."""
+    metrics.REGISTRY.reset()
+    chunks = []
+    pages = 0
+    cache_hits = 0
+    for page_chunks, hit in _iter_page_range(pdf_path, doc_id, cache_dir=cache_dir):
+        pages += 1
+        cache_hits += hit
+        chunks.extend(page_chunks)
+    return chunks, pages, cache_hits, metrics.REGISTRY.snapshot()
+
+
+def _trim_partial(partial_path: Path, group_key: Callable[[Dict[str, Any]], Any]) -> List[Any]:
+    """
+    Trims a chunk file left behind by a crashed run so it ends on a complete group
+    (a page, or a whole document in corpus mode) and returns the complete group keys.
+    The last group seen may have been cut off mid-way, so it is always dropped and redone.
+    """
+    keys, last_key, last_offset, offset = [], None, 0, 0
+    with open(partial_path, 'rb') as f:
+        for line in f:
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("truncated line")
+                key = group_key(json.loads(line))
+            except (ValueError, KeyError):
+                break
+            if key != last_key:
+                if last_key is not None:
+                    keys.append(last_key)
+                last_key, last_offset = key, offset
+            offset += len(line)
+
+    with open(partial_path, 'r+b') as f:
+        f.truncate(last_offset)
+    return keys
+
+
+def _write_chunks(chunks: Iterable[Dict[str, Any]], partial_path: Path, chunks_path: Path, append: bool = False) -> int:
+    """
+    Streams chunks to disk as JSON Lines (one chunk per line).
+    Output goes to a '.partial' file that is flushed per chunk and only
+    renamed to chunks_path once the stream is exhausted.
+    """
+    count = 0
+    with open(partial_path, 'a' if append else 'w', encoding='utf-8') as f:
+        for chunk in chunks:
+            f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+            f.flush()
+            count += 1
+        os.fsync(f.fileno())
+    os.replace(partial_path, chunks_path)
+    print(f"Saved chunks to: {chunks_path}")
+    return count
+
+
+def _partial_path_for(chunks_path: Path, suffix: str = ".partial") -> Path:
+    # In-progress output; survives a crash so the next run can resume from it
+    return chunks_path.with_name(chunks_path.name + suffix)
+
 
 class DocumentProcessor:
-    def __init__(self):
-        self.pdf_path = config.PDF_PATH
+    def __init__(self, pdf_path: Optional[Path] = None):
+        self.pdf_path = Path(pdf_path or config.PDF_PATH)
+        self.doc_id = make_doc_id(self.pdf_path)
         self.chunks_path = config.CHUNKS_PATH
-        self.images_dir = config.IMAGES_DIR
+        self.partial_path = _partial_path_for(self.chunks_path)
+        # Per-document folder so corpus runs don't wipe each other's images
+        self.images_dir = config.IMAGES_DIR / self.doc_id
         
         # Ensure clean state for images
         if self.images_dir.exists():
             shutil.rmtree(self.images_dir)
         self.images_dir.mkdir(parents=True, exist_ok=True)
 
-    def _table_to_markdown(self, table: List[List[str]]) -> str:
+    @staticmethod
+    def _clean_table(table: List[List[str]]) -> List[List[str]]:
+        """Clean cells (remove None, newlines)."""
+        return [[str(cell).replace('\n', ' ').strip() if cell else "" for cell in row] for row in table]
+
+    @staticmethod
+    def _table_to_markdown(table: List[List[str]]) -> str:
         """
         Converts a raw list of lists into a Markdown table string.
         Crucial for the LLM to understand financial data.
@@ -24,8 +263,7 @@ class DocumentProcessor:
         if not table or len(table) < 2:
             return ""
 
-        # Clean cells (remove None, newlines)
-        cleaned_table = [[str(cell).replace('\n', ' ').strip() if cell else "" for cell in row] for row in table]
+        cleaned_table = DocumentProcessor._clean_table(table)
         
         # Construct Header
         header = "| " + " | ".join(cleaned_table[0]) + " |"
@@ -38,88 +276,292 @@ class DocumentProcessor:
             
         return f"\n{header}\n{separator}\n" + "\n".join(body_rows) + "\n"
 
-    def process_pdf(self) -> List[Dict[str, Any]]:
+    @staticmethod
+    def _extract_page(page, page_num: int, source: str, doc_id: str) -> List[Dict[str, Any]]:
+        """
+        Turns a single pdfplumber page into citation-ready chunks: one for the
+        page text (and image references) plus one per table, so a numeric
+        lookup can retrieve just the table instead of the whole page.
+        Returns an empty list for pages with no usable content.
+        """
+        base_metadata = {"source": source, "doc_id": doc_id, "page": page_num}
+        chunks = []
+
+        # 1. Extract Text
+        text_content = page.extract_text() or ""
+
+        # 2. Extract Tables & Convert to Markdown
+        # pdfplumber is excellent at finding financial tables.
+        # Each table becomes its own chunk with its row/column structure in metadata.
+        for table in page.extract_tables():
+            with metrics.timed("table_conversion"):
+                md_table = DocumentProcessor._table_to_markdown(table)
+                cleaned_table = DocumentProcessor._clean_table(table)
+            if not md_table:
+                continue
+            table_number = sum(1 for c in chunks if c["metadata"]["chunk_type"] == "table") + 1
+            chunks.append({
+                "page_content": f"### TABLE {table_number} ON PAGE {page_num}\n{md_table}",
+                "metadata": {
+                    **base_metadata,
+                    "chunk_type": "table",
+                    "table_index": table_number,
+                    "columns": cleaned_table[0],
+                    "row_headers": [row[0] for row in cleaned_table[1:] if row and row[0]],
+                    "n_rows": len(cleaned_table) - 1,
+                    "n_cols": len(cleaned_table[0]),
+                    "has_tables": True,
+                    "has_images": False
+                }
+            })
+
+        # 3. Extract Images (Basic Extraction)
+        # We save them to disk so the UI can display them later if needed
+        image_references = []
+        for img_idx, img in enumerate(page.images):
+            # Create a visual placeholder in the text
+            img_name = f"page_{page_num}_img_{img_idx+1}.png"
+            image_references.append(f"[IMAGE_REF: {img_name}]")
+
+            # Note: Deep extraction of image binary requires 'page.images' coordinates
+            # combined with 'page.crop()'. For speed/storage, we just log existence here.
+            # If you need actual cropping, we can add that utility.
+
+        # 4. Combine text and visuals into the page's text chunk
+        full_content = ""
+
+        if text_content:
+            full_content += f"### TEXT CONTENT\n{text_content}\n"
+
+        if image_references:
+            full_content += "\n### VISUALS\n" + "\n".join(image_references)
+
+        # 5. Create the Final Chunk Objects (text first, then tables in page order)
+        if full_content.strip():
+            chunks.insert(0, {
+                "page_content": full_content,
+                "metadata": {
+                    **base_metadata,
+                    "chunk_type": "text",
+                    "has_tables": False,
+                    "has_images": len(image_references) > 0
+                }
+            })
+
+        return chunks
+
+    def process_pdf(
+        self,
+        workers: Optional[int] = None,
+        use_cache: bool = True,
+        start_page: int = 1
+    ) -> Iterator[Dict[str, Any]]:
         """
         Main pipeline:
         1. Extract text page-by-page.
         2. Identify and format tables as Markdown.
         3. Extract images to disk.
         4. create citation-ready chunks.
+        5. Split each page into token-budgeted sub-page chunks (see PageChunker).
+
+        Chunks are yielded page by page (in page order) so callers can stream
+        them to disk instead of holding the whole document in memory.
+
+        With workers > 1 the page range is sharded across a process pool
+        (each worker opens its own pdfplumber handle) and merged back in page order.
+
+        Pages whose content stream is unchanged since a previous run are served
+        from the per-page cache instead of being re-extracted.
         """
+        workers = workers or config.INGESTION_WORKERS
+        cache_dir = None
+        if use_cache:
+            config.PAGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            cache_dir = str(config.PAGE_CACHE_DIR)
         print(f"Processing: {self.pdf_path.name}")
-        processed_chunks = []
 
         if not self.pdf_path.exists():
             raise FileNotFoundError(f"PDF not found at {self.pdf_path}")
 
         with pdfplumber.open(self.pdf_path) as pdf:
             total_pages = len(pdf.pages)
-            
-            for i, page in enumerate(pdf.pages):
-                page_num = i + 1
-                print(f"   - Processing Page {page_num}/{total_pages}...", end="\r")
 
-                # 1. Extract Text
-                text_content = page.extract_text() or ""
-
-                # 2. Extract Tables & Convert to Markdown
-                # pdfplumber is excellent at finding financial tables
-                tables = page.extract_tables()
-                table_texts = []
-                for table in tables:
-                    md_table = self._table_to_markdown(table)
-                    if md_table:
-                        table_texts.append(md_table)
-                
-                # 3. Extract Images (Basic Extraction)
-                # We save them to disk so the UI can display them later if needed
-                image_references = []
-                for img_idx, img in enumerate(page.images):
-                    # Create a visual placeholder in the text
-                    img_name = f"page_{page_num}_img_{img_idx+1}.png"
-                    image_references.append(f"[IMAGE_REF: {img_name}]")
-                    
-                    # Note: Deep extraction of image binary requires 'page.images' coordinates
-                    # combined with 'page.crop()'. For speed/storage, we just log existence here.
-                    # If you need actual cropping, we can add that utility.
-
-                # 4. Combine into a rich context chunk
-                # We prepend tables so the LLM sees structured data first.
-                full_content = ""
-                
-                if table_texts:
-                    full_content += f"### TABLES ON PAGE {page_num}\n"
-                    full_content += "\n".join(table_texts) + "\n\n"
-                
-                if text_content:
-                    full_content += f"### TEXT CONTENT\n{text_content}\n"
-
-                if image_references:
-                    full_content += "\n### VISUALS\n" + "\n".join(image_references)
-
-                # 5. Create the Final Chunk Object
-                if full_content.strip():
-                    chunk = {
-                        "page_content": full_content,
-                        "metadata": {
-                            "source": self.pdf_path.name,
-                            "page": page_num,
-                            "has_tables": len(tables) > 0,
-                            "has_images": len(image_references) > 0
-                        }
-                    }
-                    processed_chunks.append(chunk)
-
-        print(f"\nExtracted {len(processed_chunks)} chunks.")
-        return processed_chunks
-
-    def save_chunks(self, chunks: List[Dict[str, Any]]):
-        with open(self.chunks_path, 'w', encoding='utf-8') as f:
-            json.dump(chunks, f, indent=4, ensure_ascii=False)
-        print(f"Saved chunks to: {self.chunks_path}")
+        start = start_page - 1
+        if start > 0:
+            print(f"   - Resuming from Page {start_page}/{total_pages}")
+
+        chunk_count = 0
+        cache_hits = 0
+        if workers <= 1 or total_pages - start < 2:
+            page_results = _iter_page_range(
+                str(self.pdf_path), self.doc_id, start, total_pages, cache_dir=cache_dir, show_progress=True
+            )
+        else:
+            page_results = self._iter_parallel(start, total_pages, workers, cache_dir)
+
+        for page_chunks, hit in page_results:
+            cache_hits += hit
+            chunk_count += len(page_chunks)
+            yield from page_chunks
+
+        print(f"\nExtracted {chunk_count} chunks.")
+        if use_cache:
+            print(f"   - Reused {cache_hits}/{total_pages - start} pages from cache")
+
+    def _iter_parallel(
+        self, start: int, total_pages: int, workers: int, cache_dir: Optional[str]
+    ) -> Iterator[Tuple[List[Dict[str, Any]], bool]]:
+        """Shards pages into contiguous ranges and extracts them in worker processes."""
+        # Several shards per worker so one table-heavy range doesn't leave the others idle
+        shard_size = max(1, math.ceil((total_pages - start) / (workers * SHARDS_PER_WORKER)))
+        shards = [(lo, min(lo + shard_size, total_pages)) for lo in range(start, total_pages, shard_size)]
+        workers = min(workers, len(shards))
+        print(f"   - Extracting {total_pages - start} pages in {len(shards)} shards across {workers} workers...")
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Only a bounded window of shards is in flight, and results are consumed
+            # strictly in submission order, so pages stay ordered and memory stays flat
+            shard_iter = iter(shards)
+            pending = deque()
+            for lo, hi in itertools.islice(shard_iter, workers * 2):
+                pending.append((lo, hi, executor.submit(_extract_page_range, str(self.pdf_path), self.doc_id, lo, hi, cache_dir)))
+
+            while pending:
+                lo, hi, future = pending.popleft()
+                shard_results, shard_metrics = future.result()
+                metrics.REGISTRY.merge(shard_metrics)
+
+                next_shard = next(shard_iter, None)
+                if next_shard:
+                    n_lo, n_hi = next_shard
+                    pending.append((n_lo, n_hi, executor.submit(_extract_page_range, str(self.pdf_path), self.doc_id, n_lo, n_hi, cache_dir)))
+
+                print(f"   - Processed Pages {lo + 1}-{hi}/{total_pages}...", end="\r")
+                yield from shard_results
+
+    def _recover_partial(self) -> int:
+        """
+        Trims a chunk file left behind by a crashed run back to the last fully
+        written page and returns the page to resume from (1 if nothing to resume).
+        """
+        if not self.partial_path.exists():
+            return 1
+        if self.partial_path.stat().st_mtime < self.pdf_path.stat().st_mtime:
+            # The PDF changed since the crash; the partial output is stale
+            self.partial_path.unlink()
+            return 1
+
+        done_pages = _trim_partial(
+            self.partial_path, lambda chunk: (chunk["metadata"].get("doc_id"), chunk["metadata"]["page"])
+        )
+        if any(doc_id != self.doc_id for doc_id, _ in done_pages):
+            # Left behind by a different document (or a corpus run); start over
+            self.partial_path.unlink()
+            return 1
+        return done_pages[-1][1] + 1 if done_pages else 1
+
+    def save_chunks(self, chunks: Iterable[Dict[str, Any]], append: bool = False) -> int:
+        """Streams chunks to chunks_path as JSON Lines (see _write_chunks)."""
+        return _write_chunks(chunks, self.partial_path, self.chunks_path, append=append)
+
+    def ingest(self, workers: Optional[int] = None, use_cache: bool = True, resume: bool = True) -> int:
+        """Extracts the PDF straight into the chunk file, resuming a crashed run if possible."""
+        start_page = self._recover_partial() if resume else 1
+        chunks = self.process_pdf(workers=workers, use_cache=use_cache, start_page=start_page)
+        return self.save_chunks(chunks, append=start_page > 1)
+
+
+class CorpusProcessor:
+    """
+    Ingests every PDF under a directory into one shared chunk file.
+    Documents are extracted concurrently by a bounded process pool and each
+    chunk is tagged with its document's doc_id.
+    """
+
+    def __init__(self, root: Optional[Path] = None):
+        self.root = Path(root or config.RAW_DATA_DIR)
+        self.pdf_paths = discover_pdfs(self.root)
+        self.chunks_path = config.CHUNKS_PATH
+        self.partial_path = _partial_path_for(self.chunks_path, suffix=".corpus.partial")
+
+    def latest_input_mtime(self) -> float:
+        """Newest modification time across the corpus (including added/removed files)."""
+        mtimes = [p.stat().st_mtime for p in self.pdf_paths]
+        mtimes += [d.stat().st_mtime for d in [self.root, *self.root.rglob("*")] if d.is_dir()]
+        return max(mtimes)
+
+    def process_corpus(
+        self,
+        workers: Optional[int] = None,
+        use_cache: bool = True,
+        skip_doc_ids: Iterable[str] = ()
+    ) -> Iterator[Dict[str, Any]]:
+        """Yields chunks document by document, in discovery order."""
+        workers = workers or config.INGESTION_WORKERS
+        cache_dir = None
+        if use_cache:
+            config.PAGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            cache_dir = str(config.PAGE_CACHE_DIR)
+
+        skip_doc_ids = set(skip_doc_ids)
+        jobs = [(str(p), make_doc_id(p)) for p in self.pdf_paths]
+        jobs = [job for job in jobs if job[1] not in skip_doc_ids]
+        print(f"Processing corpus: {len(jobs)} PDFs under {self.root} ({len(skip_doc_ids)} already done)")
+        if not jobs:
+            return
+
+        chunk_count = 0
+        page_count = 0
+        cache_hits = 0
+        workers = max(1, min(workers, len(jobs)))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Bounded window of documents in flight, consumed in submission order
+            job_iter = iter(jobs)
+            pending = deque()
+            for pdf_path, doc_id in itertools.islice(job_iter, workers * 2):
+                pending.append((doc_id, executor.submit(_extract_document, pdf_path, doc_id, cache_dir)))
+
+            done = 0
+            while pending:
+                doc_id, future = pending.popleft()
+                doc_chunks, doc_pages, doc_hits, doc_metrics = future.result()
+                metrics.REGISTRY.merge(doc_metrics)
+
+                next_job = next(job_iter, None)
+                if next_job:
+                    pending.append((next_job[1], executor.submit(_extract_document, next_job[0], next_job[1], cache_dir)))
+
+                done += 1
+                chunk_count += len(doc_chunks)
+                page_count += doc_pages
+                cache_hits += doc_hits
+                print(f"   - [{done}/{len(jobs)}] {doc_id}: {len(doc_chunks)} chunks from {doc_pages} pages")
+                yield from doc_chunks
+
+        print(f"\nExtracted {chunk_count} chunks from {len(jobs)} documents.")
+        if use_cache:
+            print(f"   - Reused {cache_hits}/{page_count} pages from cache")
+
+    def _recover_partial(self) -> List[str]:
+        """Trims a crashed run's output to whole documents and returns their doc_ids."""
+        if not self.partial_path.exists():
+            return []
+        if self.partial_path.stat().st_mtime < self.latest_input_mtime():
+            # The corpus changed since the crash; the partial output is stale
+            self.partial_path.unlink()
+            return []
+        return _trim_partial(self.partial_path, lambda chunk: chunk["metadata"]["doc_id"])
+
+    def ingest(self, workers: Optional[int] = None, use_cache: bool = True, resume: bool = True) -> int:
+        """Extracts the whole corpus into the shared chunk file, resuming a crashed run if possible."""
+        if not self.pdf_paths:
+            raise FileNotFoundError(f"No PDFs found under {self.root}")
+        done_doc_ids = self._recover_partial() if resume else []
+        chunks = self.process_corpus(workers=workers, use_cache=use_cache, skip_doc_ids=done_doc_ids)
+        return _write_chunks(chunks, self.partial_path, self.chunks_path, append=bool(done_doc_ids))
+
 
 if __name__ == "__main__":
     # Test run
     processor = DocumentProcessor()
-    chunks = processor.process_pdf()
-    processor.save_chunks(chunks)
\ No newline at end of file
+    processor.ingest()
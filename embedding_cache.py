@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Persistent cache of chunk embeddings keyed by a hash of (model name, chunk text).
+
+    Each model gets its own folder with three append-only files:
+        keys.txt     - one hex key per line; the line number is the vector's row
+        vectors.f32  - raw float32 rows, memory-mapped for lookups
+        meta.json    - {"model": ..., "dim": ...}
+    """
+
+    def __init__(self, cache_dir: Path, model_name: str):
+        self.model_name = model_name
+        self.cache_dir = Path(cache_dir) / re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self.keys_path = self.cache_dir / "keys.txt"
+        self.vectors_path = self.cache_dir / "vectors.f32"
+        self.meta_path = self.cache_dir / "meta.json"
+
+        self.dim = None
+        if self.meta_path.exists():
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.dim = json.load(f)["dim"]
+
+        self._rows: Dict[str, int] = {}
+        self._vectors = None
+        self._load_keys()
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _load_keys(self):
+        if self.dim is None or not self.keys_path.exists():
+            return
+
+        with open(self.keys_path, 'r', encoding='utf-8') as f:
+            keys = [line.strip() for line in f if line.strip()]
+
+        # A crash can leave the two files out of step; keep the common prefix
+        row_bytes = self.dim * np.dtype(np.float32).itemsize
+        vector_bytes = self.vectors_path.stat().st_size if self.vectors_path.exists() else 0
+        rows = min(len(keys), vector_bytes // row_bytes)
+        if rows < len(keys) or rows * row_bytes != vector_bytes:
+            keys = keys[:rows]
+            with open(self.keys_path, 'w', encoding='utf-8') as f:
+                f.writelines(k + "\n" for k in keys)
+            with open(self.vectors_path, 'ab') as f:
+                f.truncate(rows * row_bytes)
+
+        self._rows = {k: i for i, k in enumerate(keys)}
+
+    def _mapped_vectors(self) -> np.ndarray:
+        """Read-only memory map over every cached row (re-opened after appends)."""
+        if self._vectors is None:
+            self._vectors = np.memmap(
+                self.vectors_path, dtype=np.float32, mode='r', shape=(len(self._rows), self.dim)
+            )
+        return self._vectors
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def get_many(self, keys: Sequence[str]) -> Dict[int, List[float]]:
+        """Returns {position in keys: vector} for every key that is cached."""
+        hits = [(pos, self._rows[k]) for pos, k in enumerate(keys) if k in self._rows]
+        if not hits:
+            return {}
+        rows = self._mapped_vectors()[[row for _, row in hits]]
+        return {pos: vector.tolist() for (pos, _), vector in zip(hits, rows)}
+
+    def add_many(self, keys: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """Appends new vectors; keys already present are skipped."""
+        new_keys, new_vectors, seen = [], [], set()
+        for k, vector in zip(keys, vectors):
+            if k not in self._rows and k not in seen:
+                seen.add(k)
+                new_keys.append(k)
+                new_vectors.append(vector)
+        if not new_keys:
+            return
+
+        array = np.asarray(new_vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = int(array.shape[1])
+            with open(self.meta_path, 'w', encoding='utf-8') as f:
+                json.dump({"model": self.model_name, "dim": self.dim}, f)
+
+        # Vectors first, then keys: a key is only ever visible once its row is on disk
+        with open(self.vectors_path, 'ab') as f:
+            f.write(array.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.keys_path, 'a', encoding='utf-8') as f:
+            f.writelines(k + "\n" for k in new_keys)
+
+        for k in new_keys:
+            self._rows[k] = len(self._rows)
+        self._vectors = None
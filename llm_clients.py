@@ -0,0 +1,357 @@
+import asyncio
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from langchain_community.chat_models import ChatOllama
+from langchain_community.llms.ollama import OllamaEndpointNotFoundError
+import config
+
+# ==========================================
+# 🔌 SHARED HTTP CLIENTS FOR THE LLM BACKENDS
+# ==========================================
+# One keep-alive connection pool per process (and per event loop for async),
+# shared by every QAEngine, so a question never pays TCP/TLS setup. Transient
+# failures are retried with exponential backoff; with several Ollama servers
+# (OLLAMA_BASE_URLS) a BackendRouter spreads requests and fails over.
+
+# Rate limiting, gateway errors and a model still loading are worth a retry
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+_async_sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+_groq_clients: Dict[str, Any] = {}
+_routers: Dict[tuple, "BackendRouter"] = {}
+
+
+def get_session() -> requests.Session:
+    """Process-wide requests session with a bounded keep-alive pool and retries."""
+    global _session
+    with _lock:
+        if _session is None:
+            retry = Retry(
+                total=config.LLM_MAX_RETRIES,
+                read=0,  # a stalled backend is failed over, not waited on again
+                backoff_factor=config.LLM_RETRY_BACKOFF,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=None,  # generate/chat POSTs are safe to resend
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(pool_maxsize=config.LLM_POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+    return _session
+
+
+def get_async_session() -> aiohttp.ClientSession:
+    """aiohttp session for the running event loop (sessions cannot cross loops)."""
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=config.LLM_POOL_SIZE * max(1, len(config.OLLAMA_BASE_URLS)),
+                limit_per_host=config.LLM_POOL_SIZE,
+                keepalive_timeout=config.LLM_KEEPALIVE_SECONDS
+            ),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=config.LLM_CONNECT_TIMEOUT,
+                sock_read=config.LLM_READ_TIMEOUT
+            )
+        )
+        _async_sessions[loop] = session
+    return session
+
+
+async def apost(url: str, **kwargs) -> aiohttp.ClientResponse:
+    """
+    POST on the shared async session, retrying connection errors and
+    RETRY_STATUSES with exponential backoff. Timeouts are not retried (a
+    stalled backend is failed over instead). The caller releases the response.
+    """
+    for attempt in range(config.LLM_MAX_RETRIES + 1):
+        last_attempt = attempt == config.LLM_MAX_RETRIES
+        try:
+            response = await get_async_session().post(url, **kwargs)
+        except asyncio.TimeoutError:
+            raise
+        except aiohttp.ClientConnectionError:
+            if last_attempt:
+                raise
+        else:
+            if response.status not in RETRY_STATUSES or last_attempt:
+                return response
+            response.release()
+        await asyncio.sleep(config.LLM_RETRY_BACKOFF * 2 ** attempt)
+
+
+async def aclose_clients() -> None:
+    """
+    Closes the aiohttp pool of the running event loop; call before the loop ends.
+    The Groq httpx clients are left open: every ChatGroq built from
+    groq_client_kwargs() holds them for the life of the process.
+    """
+    session = _async_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+def groq_client_kwargs() -> Dict[str, Any]:
+    """ChatGroq arguments that route it through shared httpx pools (the Groq SDK retries with backoff)."""
+    import httpx  # installed with the groq SDK
+    limits = httpx.Limits(
+        max_connections=config.LLM_POOL_SIZE,
+        max_keepalive_connections=config.LLM_POOL_SIZE,
+        keepalive_expiry=config.LLM_KEEPALIVE_SECONDS
+    )
+    timeout = httpx.Timeout(config.LLM_READ_TIMEOUT, connect=config.LLM_CONNECT_TIMEOUT)
+    with _lock:
+        if "sync" not in _groq_clients:
+            _groq_clients["sync"] = httpx.Client(limits=limits, timeout=timeout)
+        if "async" not in _groq_clients:
+            _groq_clients["async"] = httpx.AsyncClient(limits=limits, timeout=timeout)
+    return {
+        "http_client": _groq_clients["sync"],
+        "http_async_client": _groq_clients["async"],
+        "max_retries": config.LLM_MAX_RETRIES,
+        "request_timeout": config.LLM_READ_TIMEOUT
+    }
+
+
+class BackendRouter:
+    """
+    Spreads LLM requests over several Ollama servers.
+
+    - Least outstanding requests: a request goes to the healthy backend with
+      the fewest requests in flight (round robin among ties).
+    - Health: a backend that errors or stalls (silent for LLM_READ_TIMEOUT) is
+      marked down for LLM_BACKEND_COOLDOWN_SECONDS, then has to pass a health
+      probe (GET /api/version) before it gets traffic again.
+    - Failover: a request that fails before its first byte is resent to the
+      next backend. When every backend is down, the one down longest is tried.
+    """
+
+    def __init__(self, urls: List[str]):
+        self.backends = [
+            {"url": url.rstrip("/"), "healthy": True, "down_until": 0.0, "outstanding": 0, "requests": 0, "failures": 0}
+            for url in urls
+        ]
+        self._lock = threading.Lock()
+        self._turn = 0
+
+    def acquire(self, exclude: List[str] = ()) -> Optional[Dict[str, Any]]:
+        """Picks a backend not in `exclude` and counts the request as outstanding."""
+        now = time.monotonic()
+        with self._lock:
+            remaining = [backend for backend in self.backends if backend["url"] not in exclude]
+            if not remaining:
+                return None
+            candidates = [backend for backend in remaining if backend["healthy"] or now >= backend["down_until"]]
+            if not candidates:
+                candidates = [min(remaining, key=lambda backend: backend["down_until"])]
+            fewest = min(backend["outstanding"] for backend in candidates)
+            ties = [backend for backend in candidates if backend["outstanding"] == fewest]
+            self._turn += 1
+            backend = ties[self._turn % len(ties)]
+            backend["outstanding"] += 1
+            backend["requests"] += 1
+            return backend
+
+    def release(self, backend: Dict[str, Any], error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            backend["outstanding"] -= 1
+        self.mark(backend, error)
+
+    def mark(self, backend: Dict[str, Any], error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            if error is None:
+                backend["healthy"] = True
+                return
+            if backend["healthy"]:
+                print(f"⚠️ LLM backend {backend['url']} marked down: {error}")
+            backend["healthy"] = False
+            backend["failures"] += 1
+            backend["down_until"] = time.monotonic() + config.LLM_BACKEND_COOLDOWN_SECONDS
+
+    def check(self, backend: Dict[str, Any]) -> bool:
+        """Health probe; updates the backend's state."""
+        try:
+            response = get_session().get(f"{backend['url']}/api/version", timeout=config.LLM_CONNECT_TIMEOUT)
+            error = None if response.status_code == 200 else ValueError(f"health check returned {response.status_code}")
+        except requests.RequestException as e:
+            error = e
+        self.mark(backend, error)
+        return error is None
+
+    async def acheck(self, backend: Dict[str, Any]) -> bool:
+        try:
+            async with get_async_session().get(
+                f"{backend['url']}/api/version",
+                timeout=aiohttp.ClientTimeout(total=config.LLM_CONNECT_TIMEOUT)
+            ) as response:
+                error = None if response.status == 200 else ValueError(f"health check returned {response.status}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = e
+        self.mark(backend, error)
+        return error is None
+
+    def check_all(self) -> List[Dict[str, Any]]:
+        for backend in self.backends:
+            self.check(backend)
+        return self.status()
+
+    def status(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {key: backend[key] for key in ("url", "healthy", "outstanding", "requests", "failures")}
+                for backend in self.backends
+            ]
+
+
+def get_router(urls: Optional[List[str]] = None) -> BackendRouter:
+    """Router for a set of Ollama URLs (default OLLAMA_BASE_URLS), shared by every engine using it."""
+    key = tuple(urls or config.OLLAMA_BASE_URLS)
+    with _lock:
+        if key not in _routers:
+            _routers[key] = BackendRouter(list(key))
+        return _routers[key]
+
+
+class PooledChatOllama(ChatOllama):
+    """
+    ChatOllama whose requests go through the shared keep-alive pools, with
+    connect/read timeouts and retries. The stock client opens a new
+    connection (and, for async calls, a new aiohttp session) per request.
+    Requests are spread over the router's backends; base_url only names the
+    API root that request paths are taken relative to.
+    """
+
+    router: Optional[Any] = None
+
+    def _request_payload(self, payload: Any, stop: Optional[List[str]], **kwargs: Any) -> Dict[str, Any]:
+        # Same request body as ChatOllama._create_stream builds
+        if self.stop is not None and stop is not None:
+            raise ValueError("`stop` found in both the input and default params.")
+        elif self.stop is not None:
+            stop = self.stop
+
+        params = self._default_params
+        for key in self._default_params:
+            if key in kwargs:
+                params[key] = kwargs[key]
+
+        if "options" in kwargs:
+            params["options"] = kwargs["options"]
+        else:
+            params["options"] = {
+                **params["options"],
+                "stop": stop,
+                **{k: v for k, v in kwargs.items() if k not in self._default_params},
+            }
+
+        if payload.get("messages"):
+            return {"messages": payload.get("messages", []), **params}
+        return {"prompt": payload.get("prompt"), "images": payload.get("images", []), **params}
+
+    def _headers(self) -> Dict[str, str]:
+        return {"Content-Type": "application/json", **(self.headers if isinstance(self.headers, dict) else {})}
+
+    def _status_error(self, url: str, status: int, detail: str) -> Exception:
+        if status == 404:
+            return OllamaEndpointNotFoundError(
+                f"Ollama call to {url} failed with status code 404. Maybe your model is not found "
+                f"and you should pull the model with `ollama pull {self.model}`."
+            )
+        return ValueError(f"Ollama call to {url} failed with status code {status}. Details: {detail}")
+
+    def _get_router(self) -> BackendRouter:
+        return self.router or get_router()
+
+    def _create_stream(self, api_url: str, payload: Any, stop: Optional[List[str]] = None, **kwargs: Any) -> Iterator[str]:
+        path = api_url[len(self.base_url.rstrip("/")):]
+        body = self._request_payload(payload, stop, **kwargs)
+        router = self._get_router()
+        tried, last_error = [], None
+
+        while True:
+            backend = router.acquire(tried)
+            if backend is None:
+                raise last_error or ValueError("No Ollama backends configured (OLLAMA_BASE_URLS)")
+            tried.append(backend["url"])
+            url = backend["url"] + path
+            try:
+                if not backend["healthy"] and not router.check(backend):
+                    raise ConnectionError(f"{backend['url']} failed its health check")
+                response = get_session().post(
+                    url=url,
+                    headers=self._headers(),
+                    auth=self.auth,
+                    json=body,
+                    stream=True,
+                    timeout=(config.LLM_CONNECT_TIMEOUT, config.LLM_READ_TIMEOUT)
+                )
+                if response.status_code != 200:
+                    raise self._status_error(url, response.status_code, response.text)
+            except (requests.RequestException, ConnectionError, ValueError, OllamaEndpointNotFoundError) as e:
+                # Nothing was streamed yet: fail over to the next backend
+                router.release(backend, e)
+                last_error = e
+                continue
+            response.encoding = "utf-8"
+            return self._iter_lines(router, backend, response)
+
+    @staticmethod
+    def _iter_lines(router: BackendRouter, backend: Dict[str, Any], response: requests.Response) -> Iterator[str]:
+        # The connection returns to the pool once the stream is consumed
+        error = None
+        try:
+            yield from response.iter_lines(decode_unicode=True)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            router.release(backend, error)
+
+    async def _acreate_stream(self, api_url: str, payload: Any, stop: Optional[List[str]] = None, **kwargs: Any) -> AsyncIterator[str]:
+        path = api_url[len(self.base_url.rstrip("/")):]
+        body = self._request_payload(payload, stop, **kwargs)
+        router = self._get_router()
+        tried, last_error = [], None
+
+        while True:
+            backend = router.acquire(tried)
+            if backend is None:
+                raise last_error or ValueError("No Ollama backends configured (OLLAMA_BASE_URLS)")
+            tried.append(backend["url"])
+            url = backend["url"] + path
+            try:
+                if not backend["healthy"] and not await router.acheck(backend):
+                    raise ConnectionError(f"{backend['url']} failed its health check")
+                response = await apost(url, headers=self._headers(), auth=self.auth, json=body)
+                if response.status != 200:
+                    detail = await response.text()
+                    response.release()
+                    raise self._status_error(url, response.status, detail)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError, ValueError, OllamaEndpointNotFoundError) as e:
+                router.release(backend, e)
+                last_error = e
+                continue
+            break
+
+        error = None
+        try:
+            async with response:
+                async for line in response.content:
+                    yield line.decode("utf-8")
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            router.release(backend, error)
@@ -1,5 +1,6 @@
-from typing import List, Dict, Any
-from langchain_community.chat_models import ChatOllama
+import asyncio
+import time
+from typing import List, Dict, Any, Optional, AsyncIterator, Callable, Iterator, Tuple
 # We wrap this import in try/except so it doesn't crash locally if you didn't install groq yet
 try:
     from langchain_groq import ChatGroq
@@ -9,23 +10,93 @@ except ImportError:
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.documents import Document
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from answer_cache import AnswerCache
+from query_cache import normalize_query
+from single_flight import SingleFlight
+from llm_clients import PooledChatOllama, apost, get_router, groq_client_kwargs
+from chunker import count_tokens
+from context_builder import ContextBuilder
+from table_index import TableIndex
+import metrics
 import config
 
+# Bump whenever prompt_template changes so cached answers are not reused
+PROMPT_VERSION = "2"
+
+NO_CONTEXT_ANSWER = "I looked through the report, but I couldn't find the answer to that specific question."
+ERROR_ANSWER = "Oops! I had a little trouble thinking about that. Could you ask me again?"
+
+# Re-warm the Ollama model well inside its keep_alive window
+WARM_UP_INTERVAL_SECONDS = 30 * 60
+
+
+def _timed_tokens(tokens: Iterator[str]) -> Iterator[str]:
+    """Passes LLM tokens through, recording time to first token and total generation time."""
+    start_time = time.perf_counter()
+    first = True
+    for token in tokens:
+        if first:
+            metrics.observe("llm_first_token", time.perf_counter() - start_time)
+            first = False
+        yield token
+    metrics.observe("llm_total", time.perf_counter() - start_time)
+
+
+async def _atimed_tokens(tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+    start_time = time.perf_counter()
+    first = True
+    async for token in tokens:
+        if first:
+            metrics.observe("llm_first_token", time.perf_counter() - start_time)
+            first = False
+        yield token
+    metrics.observe("llm_total", time.perf_counter() - start_time)
+
+
 class QAEngine:
-    def __init__(self):
+    def __init__(
+        self,
+        table_index: Optional[TableIndex] = None,
+        embed_query: Optional[Callable[[str], List[float]]] = None,
+        backends: Optional[List[str]] = None,
+        index_version: Optional[Callable[[], Optional[str]]] = None
+    ):
         """
         Initializes the RAG engine.
         Switches between Ollama (Local) and Groq (Cloud) based on config.
+        With a table_index, single-figure questions are answered by direct
+        table lookup before falling back to the LLM.
+        embed_query (e.g. VectorStoreManager.embed_query) enables the
+        semantic fallback of the answer cache.
+        backends lists the Ollama URLs to balance across (default OLLAMA_BASE_URLS).
+        index_version returns the loaded index's manifest version; cached answers
+        are only reused for the index they were generated from.
         """
+        self.table_index = table_index
+        self.embed_query = embed_query
+        self.index_version = index_version or (lambda: None)
+        self._warmed_at = 0.0
+        self.context_builder = ContextBuilder()
+        # Concurrent identical questions over the same chunks share one generation
+        self.flights = SingleFlight()
+        self.answer_cache = AnswerCache(
+            namespace=f"{config.LLM_MODEL_NAME}|{PROMPT_VERSION}|{config.CONTEXT_TOKEN_BUDGET}",
+            max_size=config.ANSWER_CACHE_SIZE,
+            ttl_seconds=config.ANSWER_CACHE_TTL_SECONDS,
+            similarity=config.ANSWER_CACHE_SIMILARITY
+        )
+        metrics.REGISTRY.register_collector("answer_cache", lambda: {"answers": self.answer_cache.stats()})
+        metrics.REGISTRY.register_flights("answers", self.flights.stats)
         print(f"🤖 Initializing QA Engine in mode: {config.DEPLOYMENT_MODE}...")
         
         # 1. Select Model Provider
         if config.DEPLOYMENT_MODE == "local":
-            # Local Mode: Use Ollama
-            self.llm = ChatOllama(
+            # Local Mode: Use Ollama (over the shared keep-alive pool, routed across backends)
+            router = get_router(backends)
+            self.llm = PooledChatOllama(
                 model=config.LLM_MODEL_NAME,
-                base_url=config.OLLAMA_BASE_URL,
+                base_url=router.backends[0]["url"],
+                router=router,
                 temperature=0.3,
                 keep_alive="1h"
             )
@@ -40,7 +111,8 @@ class QAEngine:
             self.llm = ChatGroq(
                 model=config.LLM_MODEL_NAME,
                 api_key=config.GROQ_API_KEY,
-                temperature=0.3
+                temperature=0.3,
+                **groq_client_kwargs()
             )
 
         # 2. Define the "Kid-Friendly" Prompt Template
@@ -64,52 +136,92 @@ class QAEngine:
             Your Simple Explanation:"""
         )
 
+        # Fixed part of every prompt, for the per-request prompt token count
+        self._template_tokens = count_tokens(self.prompt_template.messages[0].prompt.template)
+
         # 3. Create the Chain
+        # Inputs already carry "context" and "question"; mapping each through a
+        # RunnablePassthrough would paste the whole input dict into both slots
         self.chain = (
-            {"context": RunnablePassthrough(), "question": RunnablePassthrough()}
-            | self.prompt_template
+            self.prompt_template
             | self.llm
             | StrOutputParser()
         )
 
-    def _format_docs(self, docs: List[Document]) -> str:
+    def _format_docs(self, docs: List[Document], query: str = "") -> Tuple[str, Dict[str, int]]:
         """
-        Prepares documents for the LLM context window.
+        Prepares documents for the LLM context window: repeated headers/footers
+        and sentences removed, then trimmed to CONTEXT_TOKEN_BUDGET (see ContextBuilder).
         """
-        formatted_text = ""
-        for doc in docs:
-            # Clean content slightly for the LLM
-            content = doc.page_content.replace("### TEXT CONTENT", "").replace("### TABLES", "Table Data:")
-            source = doc.metadata.get("source", "Report")
-            page = doc.metadata.get("page", "?")
-            
-            formatted_text += f"--- INFO FROM PAGE {page} ({source}) ---\n{content}\n\n"
-        return formatted_text
+        return self.context_builder.build(query, docs)
+
+    def _answer_from_table(self, query: str, retrieved_docs: List[Document]) -> Optional[Dict[str, Any]]:
+        """
+        Answers "<row> in <year>" style questions straight from the table index,
+        using only the tables among the retrieved chunks.
+        """
+        if self.table_index is None or not retrieved_docs:
+            return None
+        cell = self.table_index.lookup(query, [doc.metadata.get("chunk_id") for doc in retrieved_docs])
+        if cell is None:
+            return None
+
+        column = "" if cell["column"] == cell["year"] else f" ({cell['column']})"
+        answer = (
+            f"{cell['row']} for {cell['year']}{column} is **{cell['value']}**, "
+            f"according to the table on page {cell['page']}. [Page {cell['page']}]"
+        )
+        return {
+            "answer": answer,
+            "citations": [{
+                "rank": 1,
+                "source": cell["source"],
+                "page": cell["page"],
+                "snippet": f"| {cell['row']} | {cell['column']}: {cell['value']} |"
+            }],
+            "context_used": 0,
+            "table_lookup": True
+        }
+
+    def _prepare(self, query: str, retrieved_docs: List[Document]) -> Dict[str, Any]:
+        """
+        Steps shared by answer_question and stream_answer. Returns {"result": ...}
+        when no LLM call is needed, otherwise the chain inputs and cache keys.
+        """
+        # 0. Numeric lookups skip the LLM entirely when a table answers them
+        table_answer = self._answer_from_table(query, retrieved_docs)
+        if table_answer:
+            return {"result": table_answer}
 
-    def answer_question(self, query: str, retrieved_docs: List[Document]) -> Dict[str, Any]:
         if not retrieved_docs:
-            return {
-                "answer": "I looked through the report, but I couldn't find the answer to that specific question.",
-                "citations": []
-            }
+            return {"result": {"answer": NO_CONTEXT_ANSWER, "citations": []}}
 
-        # 1. Prepare Context
-        context_text = self._format_docs(retrieved_docs)
+        # 1. Reuse an answer generated from the same chunks for the same (or a very similar) question
+        chunk_ids = [doc.metadata.get("chunk_id") for doc in retrieved_docs]
+        question_vector = None
+        if self.embed_query is not None and config.ANSWER_CACHE_SIMILARITY > 0:
+            question_vector = self.embed_query(query)
+        index_version = self.index_version()
+        cached = self.answer_cache.get(query, chunk_ids, question_vector, index_version)
+        if cached:
+            return {"result": cached}
 
-        # 2. Generate Answer
-        try:
-            response_text = self.chain.invoke({
-                "context": context_text,
-                "question": query
-            })
-        except Exception as e:
-            print(f"Error during LLM inference: {e}")
-            return {
-                "answer": "Oops! I had a little trouble thinking about that. Could you ask me again?",
-                "citations": []
-            }
+        # 2. Prepare Context
+        with metrics.timed("prompt_construction"):
+            context, context_stats = self._format_docs(retrieved_docs, query)
+            prompt_tokens = self._template_tokens + context_stats["context_tokens"] + count_tokens(query)
+        return {
+            "result": None,
+            "inputs": {"context": context, "question": query},
+            "chunk_ids": chunk_ids,
+            "question_vector": question_vector,
+            "index_version": index_version,
+            "prompt_tokens": prompt_tokens,
+            "context_stats": context_stats
+        }
 
-        # 3. Format Citations (Raw data for the app to clean up)
+    def _finish(self, query: str, retrieved_docs: List[Document], plan: Dict[str, Any], response_text: str) -> Dict[str, Any]:
+        # 4. Format Citations (Raw data for the app to clean up)
         citations = []
         for i, doc in enumerate(retrieved_docs):
             citations.append({
@@ -119,11 +231,170 @@ class QAEngine:
                 "snippet": doc.page_content
             })
 
-        return {
+        result = {
             "answer": response_text,
             "citations": citations,
-            "context_used": len(retrieved_docs)
+            "context_used": len(retrieved_docs),
+            "prompt_tokens": plan["prompt_tokens"],
+            "context_tokens": plan["context_stats"]["context_tokens"],
+            "context_tokens_saved": plan["context_stats"]["original_context_tokens"] - plan["context_stats"]["context_tokens"]
         }
+        self.answer_cache.put(query, plan["chunk_ids"], plan["question_vector"], result, plan["index_version"])
+        return result
+
+    @staticmethod
+    def _flight_key(query: str, retrieved_docs: List[Document]) -> tuple:
+        return (normalize_query(query), tuple(doc.metadata.get("chunk_id") for doc in retrieved_docs))
+
+    def answer_question(self, query: str, retrieved_docs: List[Document]) -> Dict[str, Any]:
+        """Answers from the retrieved chunks; concurrent identical requests share one LLM call."""
+        return self.flights.do(self._flight_key(query, retrieved_docs), self._answer_question, query, retrieved_docs)
+
+    def _answer_question(self, query: str, retrieved_docs: List[Document]) -> Dict[str, Any]:
+        plan = self._prepare(query, retrieved_docs)
+        if plan["result"]:
+            return plan["result"]
+
+        # 3. Generate Answer (streamed internally so time to first token is measured)
+        try:
+            response_text = "".join(_timed_tokens(self.chain.stream(plan["inputs"])))
+        except Exception as e:
+            print(f"Error during LLM inference: {e}")
+            return {"answer": ERROR_ANSWER, "citations": []}
+
+        return self._finish(query, retrieved_docs, plan, response_text)
+
+    def stream_answer(self, query: str, retrieved_docs: List[Document]) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming variant of answer_question. Yields {"type": "token", "text": ...}
+        events as the LLM generates, then a single {"type": "result", "result": ...}
+        holding the same dict answer_question returns (full answer + citations).
+        Table lookups and cached answers arrive as one token, as does an answer
+        shared from an identical request already being generated.
+        """
+        key = self._flight_key(query, retrieved_docs)
+        call, leader = self.flights.join(key)
+        if not leader:
+            result = self.flights.wait(call)
+            if call["abandoned"]:
+                # The first request's stream was abandoned; generate our own
+                result = self.answer_question(query, retrieved_docs)
+            yield {"type": "token", "text": result["answer"]}
+            yield {"type": "result", "result": result}
+            return
+
+        result = None
+        try:
+            for event in self._stream_answer(query, retrieved_docs):
+                if event["type"] == "result":
+                    result = event["result"]
+                yield event
+        finally:
+            if result is None:
+                self.flights.abandon(key, call)
+            else:
+                self.flights.finish(key, call, result)
+
+    def _stream_answer(self, query: str, retrieved_docs: List[Document]) -> Iterator[Dict[str, Any]]:
+        plan = self._prepare(query, retrieved_docs)
+        if plan["result"]:
+            yield {"type": "token", "text": plan["result"]["answer"]}
+            yield {"type": "result", "result": plan["result"]}
+            return
+
+        # 3. Generate Answer, token by token
+        tokens = []
+        try:
+            for token in _timed_tokens(self.chain.stream(plan["inputs"])):
+                tokens.append(token)
+                yield {"type": "token", "text": token}
+        except Exception as e:
+            print(f"Error during LLM inference: {e}")
+            yield {"type": "token", "text": f"\n\n{ERROR_ANSWER}" if tokens else ERROR_ANSWER}
+            yield {"type": "result", "result": {"answer": ERROR_ANSWER, "citations": []}}
+            return
+
+        yield {"type": "result", "result": self._finish(query, retrieved_docs, plan, "".join(tokens))}
+
+    async def aanswer_question(self, query: str, retrieved_docs: List[Document]) -> Dict[str, Any]:
+        """
+        Async answer_question: the LLM call is awaited, so one process can serve
+        many questions. Concurrent identical requests share one LLM call.
+        """
+        return await self.flights.ado(self._flight_key(query, retrieved_docs), self._aanswer_question, query, retrieved_docs)
+
+    async def _aanswer_question(self, query: str, retrieved_docs: List[Document]) -> Dict[str, Any]:
+        # Table lookup, cache check and context formatting are CPU work; keep them off the event loop
+        plan = await asyncio.get_running_loop().run_in_executor(None, self._prepare, query, retrieved_docs)
+        if plan["result"]:
+            return plan["result"]
+
+        # 3. Generate Answer (streamed internally so time to first token is measured)
+        try:
+            response_text = "".join([token async for token in _atimed_tokens(self.chain.astream(plan["inputs"]))])
+        except Exception as e:
+            print(f"Error during LLM inference: {e}")
+            return {"answer": ERROR_ANSWER, "citations": []}
+
+        return self._finish(query, retrieved_docs, plan, response_text)
+
+    async def aanswer_batch(self, queries: List[str], docs_list: List[List[Document]], concurrency: int = None) -> List[Dict[str, Any]]:
+        """
+        Answers many already-retrieved questions, with at most `concurrency`
+        LLM calls in flight. Results come back in input order.
+        """
+        slots = asyncio.Semaphore(max(1, concurrency or config.BATCH_QA_CONCURRENCY))
+
+        async def answer(query: str, retrieved_docs: List[Document]) -> Dict[str, Any]:
+            async def generate() -> Dict[str, Any]:
+                async with slots:
+                    return await self._aanswer_question(query, retrieved_docs)
+            # Duplicates join the in-flight answer without taking a slot
+            return await self.flights.ado(self._flight_key(query, retrieved_docs), generate)
+
+        await self._awarm_backend()
+        return await asyncio.gather(*(answer(query, docs) for query, docs in zip(queries, docs_list)))
+
+    async def _awarm_backend(self) -> None:
+        """
+        Asks every Ollama backend to load the model (a generate request without a
+        prompt) so the first real request doesn't pay the model load. Groq needs no warm-up.
+        """
+        if config.DEPLOYMENT_MODE != "local" or time.monotonic() - self._warmed_at < WARM_UP_INTERVAL_SECONDS:
+            return
+        # Claimed up front so concurrent questions don't all send a warm-up
+        self._warmed_at = time.monotonic()
+
+        router = self.llm.router
+
+        async def warm(backend: Dict[str, Any]) -> bool:
+            try:
+                response = await apost(
+                    f"{backend['url']}/api/generate",
+                    json={"model": config.LLM_MODEL_NAME, "keep_alive": "1h"}
+                )
+                async with response:
+                    await response.read()
+                    if response.status != 200:
+                        raise ValueError(f"warm-up returned {response.status}")
+            except Exception as e:
+                # Marked down (and logged) so real requests avoid it until it recovers
+                router.mark(backend, e)
+                return False
+            return True
+
+        if not any(await asyncio.gather(*(warm(backend) for backend in router.backends))):
+            self._warmed_at = 0.0
+
+    async def aask(self, query: str, retriever) -> Dict[str, Any]:
+        """
+        Retrieves and answers one question. The LLM backend is warmed up while
+        the query is embedded and searched, so the two latencies overlap.
+        """
+        warm_up = asyncio.create_task(self._awarm_backend())
+        retrieved_docs = await retriever.ainvoke(query)
+        await warm_up
+        return await self.aanswer_question(query, retrieved_docs)
 
 if __name__ == "__main__":
     try:
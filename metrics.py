@@ -0,0 +1,244 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import config
+
+STAGE_METRIC = "rag_stage_seconds"
+# Rendered in this order; stages not listed here follow alphabetically
+STAGES = (
+    "pdf_page_extraction",
+    "table_conversion",
+    "document_embedding",
+    "query_embedding",
+    "bm25_search",
+    "faiss_search",
+    "rerank",
+    "retrieval",
+    "prompt_construction",
+    "llm_first_token",
+    "llm_total",
+)
+
+
+class Histogram:
+    """Latency histogram with Prometheus semantics (cumulative le buckets, sum, count)."""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # One count per bucket plus the +Inf bucket; stored non-cumulative
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, counts: List[int], total: float, count: int) -> None:
+        self.counts = [a + b for a, b in zip(self.counts, counts)]
+        self.sum += total
+        self.count += count
+
+    def quantile(self, q: float) -> float:
+        """Estimated like PromQL's histogram_quantile: linear within the bucket holding the rank."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                if i == len(self.buckets):
+                    # Past the largest bucket all we know is the lower bound
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """
+    Per-stage latency histograms plus cache hit/miss and single-flight counters
+    for one process.
+
+    Stages are timed with timed()/observe(). Long-lived caches register a
+    collector (a callable returning {cache_name: {"hits", "misses"}}) that is
+    read at export time; one-off caches (page and embedding caches during
+    ingestion) add their counts with record_cache(). SingleFlight instances are
+    registered with register_flights() and read the same way. Worker processes
+    send snapshot() back to the parent, which merge()s it.
+    """
+
+    def __init__(self, buckets: Optional[Tuple[float, ...]] = None):
+        self.buckets = tuple(sorted(buckets or config.METRICS_BUCKETS))
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Histogram] = {}
+        self._cache_counts: Dict[str, List[int]] = {}
+        self._collectors: Dict[str, Callable[[], Dict[str, Dict[str, Any]]]] = {}
+        self._flights: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timed(self, stage: str) -> Iterator[None]:
+        """Times the with-block (also when it raises) as one observation of `stage`."""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start_time)
+
+    def record_cache(self, cache: str, hits: int, misses: int) -> None:
+        with self._lock:
+            counts = self._cache_counts.setdefault(cache, [0, 0])
+            counts[0] += hits
+            counts[1] += misses
+
+    def register_collector(self, name: str, collector: Callable[[], Dict[str, Dict[str, Any]]]) -> None:
+        """Registers (or replaces, e.g. after a reload) a live cache stats source."""
+        with self._lock:
+            self._collectors[name] = collector
+
+    def register_flights(self, stage: str, stats: Callable[[], Dict[str, Any]]) -> None:
+        """Registers (or replaces) a SingleFlight.stats source for `stage` (e.g. "retrieval")."""
+        with self._lock:
+            self._flights[stage] = stats
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._cache_counts.clear()
+            self._collectors.clear()
+            self._flights.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Picklable histogram and cache counts, for shipping out of a worker process."""
+        with self._lock:
+            return {
+                "histograms": {stage: (list(h.counts), h.sum, h.count) for stage, h in self._histograms.items()},
+                "caches": {cache: list(counts) for cache, counts in self._cache_counts.items()}
+            }
+
+    def merge(self, snapshot: Dict[str, Any]) -> None:
+        with self._lock:
+            for stage, (counts, total, count) in snapshot["histograms"].items():
+                histogram = self._histograms.get(stage)
+                if histogram is None:
+                    histogram = self._histograms[stage] = Histogram(self.buckets)
+                histogram.merge(counts, total, count)
+        for cache, (hits, misses) in snapshot["caches"].items():
+            self.record_cache(cache, hits, misses)
+
+    def _stages(self) -> List[Tuple[str, Histogram]]:
+        with self._lock:
+            items = list(self._histograms.items())
+        order = {stage: i for i, stage in enumerate(STAGES)}
+        return sorted(items, key=lambda item: (order.get(item[0], len(STAGES)), item[0]))
+
+    def cache_stats(self) -> Dict[str, Tuple[int, int]]:
+        """(hits, misses) per cache, from the counters and the registered collectors."""
+        with self._lock:
+            stats = {cache: tuple(counts) for cache, counts in self._cache_counts.items()}
+            collectors = list(self._collectors.values())
+        for collector in collectors:
+            for cache, cache_stats in collector().items():
+                stats[cache] = (cache_stats["hits"], cache_stats["misses"])
+        return dict(sorted(stats.items()))
+
+    def flight_stats(self) -> Dict[str, Tuple[int, int]]:
+        """(executions, coalesced) per single-flight stage."""
+        with self._lock:
+            flights = list(self._flights.items())
+        stats = {}
+        for stage, flight_stats in flights:
+            counts = flight_stats()
+            stats[stage] = (counts["executions"], counts["coalesced"])
+        return dict(sorted(stats.items()))
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """count / mean / p50 / p95 / p99 (seconds) per stage."""
+        return [{
+            "stage": stage,
+            "count": histogram.count,
+            "mean": histogram.sum / histogram.count if histogram.count else 0.0,
+            "p50": histogram.quantile(0.5),
+            "p95": histogram.quantile(0.95),
+            "p99": histogram.quantile(0.99)
+        } for stage, histogram in self._stages()]
+
+    def format_summary(self) -> str:
+        """Plain-text latency table plus cache hit rates, for terminals and logs."""
+        lines = [f"{'stage':<22}{'count':>7}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}"]
+        for row in self.summary():
+            lines.append(
+                f"{row['stage']:<22}{row['count']:>7}"
+                + "".join(f"{row[key] * 1000:>8.1f}ms" for key in ("mean", "p50", "p95", "p99"))
+            )
+        for cache, (hits, misses) in self.cache_stats().items():
+            lookups = hits + misses
+            lines.append(f"{'cache ' + cache:<22}{hits:>7}/{lookups} hits ({hits / lookups if lookups else 0:.0%})")
+        for stage, (executions, coalesced) in self.flight_stats().items():
+            calls = executions + coalesced
+            lines.append(f"{'coalesced ' + stage:<22}{coalesced:>7}/{calls} calls ({coalesced / calls if calls else 0:.0%})")
+        return "\n".join(lines)
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = [
+            f"# HELP {STAGE_METRIC} Latency of each pipeline stage in seconds.",
+            f"# TYPE {STAGE_METRIC} histogram"
+        ]
+        for stage, histogram in self._stages():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), histogram.counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f'{STAGE_METRIC}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'{STAGE_METRIC}_sum{{stage="{stage}"}} {histogram.sum!r}')
+            lines.append(f'{STAGE_METRIC}_count{{stage="{stage}"}} {histogram.count}')
+
+        caches = self.cache_stats()
+        for name, kind, help_text, value in (
+            ("rag_cache_hits_total", "counter", "Cache lookups served from the cache.", lambda h, m: h),
+            ("rag_cache_misses_total", "counter", "Cache lookups that missed.", lambda h, m: m),
+            ("rag_cache_hit_ratio", "gauge", "Share of cache lookups that hit.", lambda h, m: h / (h + m) if h + m else 0.0)
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for cache, (hits, misses) in caches.items():
+                lines.append(f'{name}{{cache="{cache}"}} {value(hits, misses)}')
+
+        flights = self.flight_stats()
+        for name, help_text, value in (
+            ("rag_coalesced_total", "Requests that joined an identical in-flight request instead of running it.", lambda e, c: c),
+            ("rag_flight_executions_total", "Requests that ran (the first of each identical in-flight group).", lambda e, c: e)
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for stage, (executions, coalesced) in flights.items():
+                lines.append(f'{name}{{stage="{stage}"}} {value(executions, coalesced)}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Path) -> None:
+        """Writes render() atomically, e.g. for node_exporter's textfile collector."""
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(self.render(), encoding="utf-8")
+        tmp_path.replace(path)
+
+
+# One registry per process, shared by every manager and QA engine
+REGISTRY = MetricsRegistry()
+observe = REGISTRY.observe
+timed = REGISTRY.timed
+record_cache = REGISTRY.record_cache
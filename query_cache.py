@@ -0,0 +1,160 @@
+import json
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Hashable, List, Optional
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    """Case, whitespace and trailing punctuation don't change what is retrieved."""
+    return re.sub(r"\s+", " ", query.lower()).strip().rstrip("?!. ")
+
+
+class LRUCache:
+    """Thread-safe bounded LRU with hit/miss counters (Streamlit sessions share it)."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+class QueryCache:
+    """
+    Caches for repeated questions inside VectorStoreManager:
+        normalized query -> query embedding   (valid for as long as the model is)
+        normalized query -> top-k chunk_ids   (valid for one index version only)
+
+    Both are bounded in-memory LRUs. With a persist_path they are backed by a
+    small SQLite file, so the cache survives app restarts and is shared by
+    every process on the machine. Result entries carry the manifest version
+    they were computed against and are ignored once the index changes.
+    """
+
+    # Disk rows kept per table; the oldest writes are pruned past this
+    DISK_MAX_ROWS = 100000
+
+    def __init__(self, model_name: str, max_size: int, persist_path: Optional[Path] = None):
+        self.model_name = model_name
+        self.embeddings = LRUCache(max_size)
+        self.results = LRUCache(max_size)
+        self._results_version = None
+
+        self._db = None
+        self._db_lock = threading.Lock()
+        if persist_path:
+            self._db = sqlite3.connect(str(persist_path), check_same_thread=False)
+            self._db.executescript(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB);"
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, version TEXT, ids TEXT);"
+            )
+
+    def _db_get(self, sql: str, key: str) -> Optional[tuple]:
+        if self._db is None:
+            return None
+        with self._db_lock:
+            return self._db.execute(sql, (key,)).fetchone()
+
+    def _db_put(self, table: str, row: tuple) -> None:
+        if self._db is None:
+            return
+        placeholders = ", ".join("?" * len(row))
+        with self._db_lock:
+            cursor = self._db.execute(f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})", row)
+            if cursor.lastrowid % 1000 == 0:
+                self._db.execute(f"DELETE FROM {table} WHERE rowid <= ?", (cursor.lastrowid - self.DISK_MAX_ROWS,))
+            self._db.commit()
+
+    # ---- query -> embedding -----------------------------------------------
+
+    def get_embedding(self, query: str) -> Optional[List[float]]:
+        key = f"{self.model_name}\x00{normalize_query(query)}"
+        vector = self.embeddings.get(key)
+        if vector is None:
+            row = self._db_get("SELECT vector FROM embeddings WHERE key = ?", key)
+            if row:
+                vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+                self.embeddings.put(key, vector)
+                # Served from disk: count it as a hit rather than a miss
+                self.embeddings.hits += 1
+                self.embeddings.misses -= 1
+        return vector
+
+    def put_embedding(self, query: str, vector: List[float]) -> None:
+        key = f"{self.model_name}\x00{normalize_query(query)}"
+        self.embeddings.put(key, vector)
+        self._db_put("embeddings", (key, np.asarray(vector, dtype=np.float32).tobytes()))
+
+    # ---- query -> top-k chunk_ids -----------------------------------------
+
+    def _results_key(self, query: str, params: str) -> str:
+        return f"{params}\x00{normalize_query(query)}"
+
+    def _check_version(self, version: Optional[str]) -> None:
+        if version != self._results_version:
+            # A new index: every cached ranking is stale
+            self.results.clear()
+            self._results_version = version
+
+    def get_results(self, query: str, params: str, version: Optional[str]) -> Optional[List[int]]:
+        self._check_version(version)
+        key = self._results_key(query, params)
+        ids = self.results.get(key)
+        if ids is None and version is not None:
+            row = self._db_get("SELECT version, ids FROM results WHERE key = ?", key)
+            if row and row[0] == version:
+                ids = json.loads(row[1])
+                self.results.put(key, ids)
+                self.results.hits += 1
+                self.results.misses -= 1
+        return ids
+
+    def put_results(self, query: str, params: str, version: Optional[str], ids: List[int]) -> None:
+        self._check_version(version)
+        key = self._results_key(query, params)
+        self.results.put(key, list(ids))
+        if version is not None:
+            self._db_put("results", (key, version, json.dumps(list(ids))))
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {"query_embeddings": self.embeddings.stats(), "query_results": self.results.stats()}
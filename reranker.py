@@ -0,0 +1,87 @@
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from chunker import count_tokens
+import config
+
+
+class Reranker:
+    """
+    Cross-encoder rerank stage for an over-fetched candidate list.
+
+    Candidates are scored in batches on the CPU. Scoring stops once the next
+    batch would overrun the per-query latency budget, and scores that arrive
+    after the deadline anyway (a cold model, a long chunk, CPU contention) are
+    discarded; the query then falls back to the retriever's own order. Either
+    way the result is trimmed to k chunks and the context token budget.
+    """
+
+    def __init__(
+        self,
+        model_name: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        latency_budget_ms: Optional[float] = None,
+        token_budget: Optional[int] = None
+    ):
+        # sentence-transformers ships with langchain-huggingface; only imported when reranking is on
+        from sentence_transformers import CrossEncoder
+
+        self.model_name = model_name or config.RERANK_MODEL_NAME
+        print(f"Loading reranker {self.model_name}...")
+        self.model = CrossEncoder(self.model_name, device=config.EMBEDDING_DEVICE)
+        self.batch_size = batch_size or config.RERANK_BATCH_SIZE
+        self.latency_budget_ms = config.RERANK_LATENCY_BUDGET_MS if latency_budget_ms is None else latency_budget_ms
+        self.token_budget = config.RERANK_TOKEN_BUDGET if token_budget is None else token_budget
+        # Queries that hit the latency cap, for tuning RERANK_LATENCY_BUDGET_MS
+        self.queries = 0
+        self.fallbacks = 0
+
+    def _score(self, query: str, docs: List[Document]) -> Optional[np.ndarray]:
+        """Cross-encoder scores, or None if the latency budget ran out first."""
+        start = time.perf_counter()
+        deadline = start + self.latency_budget_ms / 1000
+        scores = []
+        slowest_batch = 0.0
+        for lo in range(0, len(docs), self.batch_size):
+            batch_start = time.perf_counter()
+            if self.latency_budget_ms > 0 and batch_start + slowest_batch > deadline:
+                return None
+            pairs = [(query, doc.page_content) for doc in docs[lo:lo + self.batch_size]]
+            scores.extend(self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False))
+            batch_end = time.perf_counter()
+            if self.latency_budget_ms > 0 and batch_end > deadline:
+                return None
+            slowest_batch = max(slowest_batch, batch_end - batch_start)
+        return np.asarray(scores)
+
+    def _trim(self, docs: List[Document], k: int) -> List[Document]:
+        """Keeps the best docs up to k and the token budget (always at least one)."""
+        kept, tokens = [], 0
+        for doc in docs[:k]:
+            doc_tokens = count_tokens(doc.page_content)
+            if kept and self.token_budget > 0 and tokens + doc_tokens > self.token_budget:
+                break
+            kept.append(doc)
+            tokens += doc_tokens
+        return kept
+
+    def rerank(self, query: str, docs: List[Document], k: int) -> Tuple[List[Document], bool]:
+        """Returns (docs, reranked); reranked is False when the retrieval order was kept."""
+        if not docs:
+            return [], True
+        self.queries += 1
+        scores = self._score(query, docs)
+        if scores is None:
+            self.fallbacks += 1
+            print(f"   - Rerank exceeded {self.latency_budget_ms:.0f} ms; using retrieval order "
+                  f"({self.fallbacks}/{self.queries} queries so far)")
+            return self._trim(docs, k), False
+
+        order = np.argsort(-scores, kind="stable")
+        ranked = []
+        for i in order:
+            docs[i].metadata["rerank_score"] = float(scores[i])
+            ranked.append(docs[i])
+        return self._trim(ranked, k), True
@@ -1,78 +1,178 @@
 import argparse
+import asyncio
+import functools
+import json
 import sys
 from pathlib import Path
 import time
 
 
 import config
-from document_processor import DocumentProcessor
-from vector_store import VectorStoreManager
+import metrics
+from document_processor import DocumentProcessor, CorpusProcessor, discover_pdfs
+from vector_store import VectorStoreManager, MANIFEST_NAME
 from llm_qa import QAEngine
+from llm_clients import get_router, aclose_clients
 
 def print_header(msg):
     print(f"\n{'='*60}\n{msg}\n{'='*60}")
 
-def check_environment():
+def check_environment(corpus=False, require_input=True):
     """Verifies that input files and directories exist."""
-    if not config.PDF_PATH.exists():
+    if require_input and corpus:
+        if not discover_pdfs(config.RAW_DATA_DIR):
+            print(f"Error: No PDFs found under {config.RAW_DATA_DIR}")
+            sys.exit(1)
+    elif require_input and not config.PDF_PATH.exists():
         print(f"Error: Input PDF not found at {config.PDF_PATH}")
         print("   Please place your 'qatar_test_doc.pdf' in data/raw/")
         sys.exit(1)
     
-    # Verify Ollama connection (lightweight check)
-    try:
-        import requests
-        response = requests.get(config.OLLAMA_BASE_URL)
-        if response.status_code != 200:
-            print("Warning: Ollama does not seem to be responding.")
-    except:
-        print("Warning: Could not connect to Ollama. Ensure 'ollama serve' is running.")
-
-def run_ingestion(force=False):
-    """Step 1: Extract text and tables from PDF."""
-    print_header("STEP 1: Document Ingestion (PDF -> JSON)")
+    # Verify the Ollama backends (lightweight health check, warms the shared connection pool)
+    if config.DEPLOYMENT_MODE == "local":
+        backends = get_router().check_all()
+        down = [backend["url"] for backend in backends if not backend["healthy"]]
+        if len(down) == len(backends):
+            print("Warning: Could not connect to Ollama. Ensure 'ollama serve' is running.")
+        elif down:
+            print(f"Warning: {len(down)}/{len(backends)} Ollama backends are not responding: {', '.join(down)}")
+
+def run_ingestion(force=False, workers=None, use_cache=True, corpus=False):
+    """
+    Step 1: Extract text and tables from PDF (or every PDF in RAW_DATA_DIR with corpus=True).
+    Returns True when chunks were (re-)extracted, so the index must be rebuilt.
+    """
+    print_header("STEP 1: Document Ingestion (PDF -> JSONL)")
     
-    if config.CHUNKS_PATH.exists() and not force:
+    corpus_processor = CorpusProcessor() if corpus else None
+    input_mtime = corpus_processor.latest_input_mtime() if corpus else config.PDF_PATH.stat().st_mtime
+
+    # A revised PDF is newer than its chunks; unchanged pages come back from the page cache
+    chunks_up_to_date = (
+        config.CHUNKS_PATH.exists()
+        and config.CHUNKS_PATH.stat().st_mtime >= input_mtime
+    )
+    if chunks_up_to_date and not force:
         print(f"ℹChunks found at {config.CHUNKS_PATH.name}")
         print("   Skipping ingestion to save time. Use --force to overwrite.")
-        return
+        return False
 
     try:
         start_time = time.time()
-        processor = DocumentProcessor()
-        chunks = processor.process_pdf()
-        processor.save_chunks(chunks)
+        processor = corpus_processor or DocumentProcessor()
+        # Streams chunks to disk page by page and resumes a crashed run
+        processor.ingest(workers=workers, use_cache=use_cache)
         print(f"Ingestion Complete in {time.time() - start_time:.2f}s")
     except Exception as e:
         print(f"Ingestion Failed: {e}")
         sys.exit(1)
+    return True
 
-def run_indexing(force=False):
+def run_indexing(force=False, use_cache=True):
     """Step 2: Create Embeddings and FAISS Index."""
-    print_header("STEP 2: Vector Indexing (JSON -> FAISS)")
+    print_header("STEP 2: Vector Indexing (JSONL -> FAISS)")
     
-    if config.VECTOR_STORE_PATH.exists() and not force:
+    # Chunks re-extracted from a revised PDF are newer than the index built from them
+    manifest_path = config.VECTOR_STORE_PATH / MANIFEST_NAME
+    index_up_to_date = (
+        manifest_path.exists()
+        and config.CHUNKS_PATH.exists()
+        and manifest_path.stat().st_mtime >= config.CHUNKS_PATH.stat().st_mtime
+    )
+    if index_up_to_date and not force:
         print(f"ℹIndex found at {config.VECTOR_STORE_PATH.name}")
         print("   Skipping indexing to save time. Use --force to overwrite.")
         return
 
     try:
         start_time = time.time()
-        manager = VectorStoreManager()
-        # This loads the JSON we created in Step 1
+        manager = VectorStoreManager(use_cache=use_cache)
+        # This streams the JSONL we created in Step 1
         manager.create_vector_store()
         print(f"Indexing Complete in {time.time() - start_time:.2f}s")
     except Exception as e:
         print(f"Indexing Failed: {e}")
         sys.exit(1)
 
+def sync_chunks_file(removed_sources, added_chunks):
+    """
+    Mirrors an incremental update in CHUNKS_PATH (drops removed documents, appends
+    added chunks), so a later rebuild from the JSONL keeps the index's documents.
+    """
+    if not config.CHUNKS_PATH.exists():
+        print(f"Warning: {config.CHUNKS_PATH.name} not found; a later rebuild won't include this update.")
+        return
+
+    # Streamed into a temporary file and renamed, so the JSONL is never half-written
+    tmp_path = config.CHUNKS_PATH.with_name(config.CHUNKS_PATH.name + ".update.tmp")
+    with open(config.CHUNKS_PATH, "r", encoding="utf-8") as src, open(tmp_path, "w", encoding="utf-8") as out:
+        for line in src:
+            if not line.strip():
+                continue
+            metadata = json.loads(line).get("metadata", {})
+            if metadata.get("source") in removed_sources or metadata.get("doc_id") in removed_sources:
+                continue
+            out.write(line if line.endswith("\n") else line + "\n")
+        for chunk in added_chunks:
+            out.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+    tmp_path.replace(config.CHUNKS_PATH)
+    print(f"Updated chunks in: {config.CHUNKS_PATH}")
+
+def run_update(add_paths=(), remove_sources=(), use_cache=True):
+    """Adds/removes individual documents in the existing index without a full rebuild."""
+    print_header("STEP 2b: Incremental Index Update")
+
+    try:
+        start_time = time.time()
+        manager = VectorStoreManager(use_cache=use_cache)
+
+        # 1. Extract the added PDFs up front (one report's chunks fit in memory)
+        added = []
+        for pdf_path in add_paths:
+            pdf_path = Path(pdf_path)
+            if config.RAW_DATA_DIR.resolve() not in pdf_path.resolve().parents:
+                print(f"Warning: {pdf_path} is outside {config.RAW_DATA_DIR}; a --corpus --force rebuild won't include it.")
+            processor = DocumentProcessor(pdf_path)
+            added.append((processor.doc_id, list(processor.process_pdf(use_cache=use_cache))))
+
+        # 2. Update the chunk file first: if the index update below fails, the
+        #    JSONL is newer than the index and the next run rebuilds from it
+        replaced = {doc_id for doc_id, _ in added}
+        sync_chunks_file(set(remove_sources) | replaced, [chunk for _, chunks in added for chunk in chunks])
+
+        # 3. Apply the same changes to the index
+        for source in remove_sources:
+            manager.remove_document(source)
+
+        for doc_id, chunks in added:
+            # Replacing a revised report: drop its old chunks first
+            manager.remove_document(doc_id)
+            manager.add_documents(chunks)
+
+        print(f"Update Complete in {time.time() - start_time:.2f}s")
+    except Exception as e:
+        print(f"Update Failed: {e}")
+        sys.exit(1)
+
+@functools.lru_cache(maxsize=None)
+def load_engines():
+    """Index and QA engine, loaded once per process and reused by every question."""
+    manager = VectorStoreManager()
+    manager.load_vector_store()
+    qa_engine = QAEngine(
+        table_index=manager.table_index,
+        embed_query=manager.embed_query,
+        index_version=lambda: manager.manifest.get("version")
+    )
+    return manager, qa_engine
+
 def run_inference(query):
     """Step 3: Run the RAG Chain."""
     print_header(f"STEP 3: QA Inference\n❓ Query: {query}")
 
     try:
         # 1. Load Retrieval Engine
-        manager = VectorStoreManager()
+        manager, qa_engine = load_engines()
         retriever = manager.get_retriever()
         
         # 2. Retrieve relevant docs
@@ -83,18 +183,30 @@ def run_inference(query):
             print("No relevant documents found for this query.")
             return
 
-        # 3. Run LLM
+        # 3. Run LLM (streamed to the terminal as it is generated)
         print(f"Generating answer with {config.LLM_MODEL_NAME}...")
         start_time = time.time()
-        
-        qa_engine = QAEngine()
-        result = qa_engine.answer_question(query, retrieved_docs)
+
+        print_header("RESULT")
+        first_token_time = None
+        result = None
+        for event in qa_engine.stream_answer(query, retrieved_docs):
+            if event["type"] == "token":
+                if first_token_time is None:
+                    first_token_time = time.time() - start_time
+                print(event["text"], end="", flush=True)
+            else:
+                result = event["result"]
         
         duration = time.time() - start_time
 
         # 4. Display Results
-        print_header("RESULT")
-        print(f"Answer ({duration:.2f}s):\n{result['answer']}\n")
+        print(f"\n\n(first token {first_token_time or 0:.2f}s, total {duration:.2f}s)\n")
+        if result.get("table_lookup"):
+            print("(Answered by direct table lookup, no LLM call)\n")
+        elif result.get("prompt_tokens"):
+            print(f"(Prompt: ~{result['prompt_tokens']} tokens, "
+                  f"{result['context_tokens_saved']} context tokens trimmed)\n")
         
         print("-" * 40)
         print("Evidence Used:")
@@ -107,24 +219,127 @@ def run_inference(query):
         print(f"Inference Failed: {e}")
         print("   (Double check that Ollama is running)")
 
+def _read_questions(questions_file):
+    """Yields (id, question) from a JSONL file with a "question" (or "query") field per line."""
+    with open(questions_file, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            question = record.get("question") or record.get("query")
+            if not question:
+                print(f"Warning: line {line_no} has no 'question' field, skipped.")
+                continue
+            yield record.get("id", line_no), question
+
+async def _answer_records(manager, qa_engine, records, out, concurrency):
+    """Answers (id, question) records window by window on one event loop, so the LLM connection pool is reused."""
+    loop = asyncio.get_running_loop()
+    answered = 0
+    try:
+        for window_start in range(0, len(records), config.BATCH_QA_WINDOW):
+            window = records[window_start:window_start + config.BATCH_QA_WINDOW]
+            questions = [question for _, question in window]
+
+            # 2. One embedding batch + one FAISS search for the whole window
+            window_time = time.time()
+            docs_list = await loop.run_in_executor(None, manager.retrieve_batch, questions)
+            print(f"Retrieved context for {len(window)} questions in {time.time() - window_time:.2f}s")
+
+            # 3. LLM generation, bounded concurrency
+            results = await qa_engine.aanswer_batch(questions, docs_list, concurrency)
+
+            # 4. Write answers in input order
+            for (question_id, question), result in zip(window, results):
+                out.write(json.dumps({
+                    "id": question_id,
+                    "question": question,
+                    "answer": result["answer"],
+                    "citations": [
+                        {"rank": cit["rank"], "source": cit.get("source"), "page": cit.get("page")}
+                        for cit in result["citations"]
+                    ],
+                    "context_used": result.get("context_used", 0),
+                    "prompt_tokens": result.get("prompt_tokens"),
+                    "cached": result.get("cached"),
+                    "table_lookup": result.get("table_lookup", False)
+                }, ensure_ascii=False) + "\n")
+            out.flush()
+            answered += len(window)
+            print(f"   {answered}/{len(records)} questions answered")
+    finally:
+        await aclose_clients()
+    return answered
+
+def run_batch(questions_file, answers_file=None, concurrency=None):
+    """Step 3 (batch): answers every question in a JSONL file and writes the answers as JSONL."""
+    questions_file = Path(questions_file)
+    answers_file = Path(answers_file) if answers_file else questions_file.with_suffix(".answers.jsonl")
+    print_header(f"STEP 3: Batch QA Inference\n❓ Questions: {questions_file}\n💾 Answers: {answers_file}")
+
+    try:
+        # 1. Load the index and the LLM once for the whole file
+        manager, qa_engine = load_engines()
+
+        start_time = time.time()
+        records = list(_read_questions(questions_file))
+        with open(answers_file, "w", encoding="utf-8") as out:
+            answered = asyncio.run(_answer_records(manager, qa_engine, records, out, concurrency))
+
+        duration = time.time() - start_time
+        print(f"Batch Complete: {answered} answers in {duration:.2f}s "
+              f"({answered / duration if duration else 0:.1f} questions/s) -> {answers_file}")
+        print(f"   Coalesced duplicates: {manager.flights.coalesced} retrievals, {qa_engine.flights.coalesced} answers")
+    except Exception as e:
+        print(f"Batch Inference Failed: {e}")
+        print("   (Double check that Ollama is running)")
+        sys.exit(1)
+
+def report_metrics(metrics_file=None):
+    """Prints per-stage latency percentiles and cache hit rates; optionally writes them for Prometheus."""
+    if not metrics.REGISTRY.summary():
+        return
+    print_header("⏱️ STAGE LATENCY")
+    print(metrics.REGISTRY.format_summary())
+    if metrics_file:
+        metrics.REGISTRY.write(Path(metrics_file))
+        print(f"\nMetrics written to: {metrics_file}")
+
 def main():
     parser = argparse.ArgumentParser(description="Run the IMF Document Intelligence Pipeline")
     
     # Arguments to control flow
     parser.add_argument("--force", action="store_true", help="Force re-ingestion and re-indexing")
     parser.add_argument("--skip-ingest", action="store_true", help="Skip PDF processing (run QA only)")
+    parser.add_argument("--corpus", action="store_true", help="Ingest every PDF under data/raw/ into one shared index")
+    parser.add_argument("--add", nargs="+", default=[], metavar="PDF", help="Add (or replace) PDFs in the existing index without a rebuild")
+    parser.add_argument("--remove", nargs="+", default=[], metavar="SOURCE", help="Remove documents (file name or doc_id) from the existing index")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore the page and embedding caches (re-parse and re-embed everything)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for PDF page extraction (default: config.INGESTION_WORKERS)")
     parser.add_argument("--query", type=str, default="What are the fiscal projections for 2024?", help="Question to ask")
+    parser.add_argument("--questions-file", type=str, default=None, metavar="JSONL", help="Answer every question in a JSONL file ({\"question\": ...} per line) instead of --query")
+    parser.add_argument("--answers-file", type=str, default=None, metavar="JSONL", help="Where batch answers are written (default: <questions-file>.answers.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=None, help="LLM generations in flight in batch mode (default: config.BATCH_QA_CONCURRENCY)")
+    parser.add_argument("--metrics-file", type=str, default=config.METRICS_FILE or None, metavar="PATH", help="Write stage latency histograms and cache hit rates in Prometheus text format (default: config.METRICS_FILE)")
     
     args = parser.parse_args()
 
-    check_environment()
+    # Incremental updates bring their own PDFs
+    check_environment(corpus=args.corpus, require_input=not (args.add or args.remove))
 
     # Pipeline Execution
-    if not args.skip_ingest:
-        run_ingestion(force=args.force)
-        run_indexing(force=args.force)
-    
-    run_inference(args.query)
+    if args.add or args.remove:
+        run_update(add_paths=args.add, remove_sources=args.remove, use_cache=not args.no_cache)
+    elif not args.skip_ingest:
+        ingested = run_ingestion(force=args.force, workers=args.workers, use_cache=not args.no_cache, corpus=args.corpus)
+        run_indexing(force=args.force or ingested, use_cache=not args.no_cache)
+
+    if args.questions_file:
+        run_batch(args.questions_file, args.answers_file, args.concurrency)
+    else:
+        run_inference(args.query)
+
+    report_metrics(args.metrics_file)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,128 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
+
+from vector_store import VectorStoreManager, ManagerRetriever
+from llm_qa import QAEngine
+from llm_clients import aclose_clients, get_router
+import metrics
+import config
+
+# ==========================================
+# 🌐 HEADLESS QUERY SERVICE
+# ==========================================
+# Long-lived JSON API over the RAG pipeline. Models and the index are loaded
+# once at startup and shared by every request. Run a single process:
+#   python service.py   (or: uvicorn service:app --port 8000)
+
+resources: Dict[str, Any] = {}
+
+
+class QuestionRequest(BaseModel):
+    question: str = Field(..., min_length=1)
+    k: Optional[int] = Field(None, ge=1, le=50, description="Chunks to retrieve (defaults to RETRIEVAL_K)")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # CPU-bound work (embedding, FAISS, BM25, reranking) runs on this bounded pool
+    executor = ThreadPoolExecutor(max_workers=config.SERVICE_WORKERS, thread_name_prefix="rag")
+    asyncio.get_running_loop().set_default_executor(executor)
+
+    manager = VectorStoreManager()
+    manager.load_vector_store()
+    resources["manager"] = manager
+    resources["retriever"] = manager.get_retriever()
+    resources["qa_engine"] = QAEngine(
+        table_index=manager.table_index,
+        embed_query=manager.embed_query,
+        index_version=lambda: manager.manifest.get("version")
+    )
+    # Requests beyond this wait for a slot instead of piling onto the LLM backend
+    resources["slots"] = asyncio.Semaphore(config.SERVICE_MAX_CONCURRENCY)
+    print(f"✅ Service ready: {manager.vectorstore.index.ntotal} chunks, "
+          f"{config.SERVICE_MAX_CONCURRENCY} concurrent questions, {config.SERVICE_WORKERS} worker threads")
+    yield
+    resources.clear()
+    await aclose_clients()
+    executor.shutdown(wait=False)
+
+
+app = FastAPI(title="IMF Insight API", lifespan=lifespan)
+
+
+def _retriever_for(k: Optional[int]):
+    if k is None or k == config.RETRIEVAL_K:
+        return resources["retriever"]
+    return ManagerRetriever(manager=resources["manager"], k=k)
+
+
+def _chunk_json(doc) -> Dict[str, Any]:
+    return {
+        "chunk_id": doc.metadata.get("chunk_id"),
+        "source": doc.metadata.get("source"),
+        "page": doc.metadata.get("page"),
+        "text": doc.page_content,
+        "metadata": doc.metadata
+    }
+
+
+@app.get("/healthz")
+async def healthz() -> Dict[str, Any]:
+    manager = resources.get("manager")
+    if manager is None or manager.vectorstore is None:
+        raise HTTPException(status_code=503, detail="Index not loaded")
+    return {
+        "status": "ok",
+        "chunks": manager.vectorstore.index.ntotal,
+        "index_version": manager.manifest.get("version"),
+        "index_type": manager.manifest.get("index_type"),
+        "retrieval_mode": config.RETRIEVAL_MODE,
+        "llm_model": config.LLM_MODEL_NAME,
+        "llm_backends": get_router().status() if config.DEPLOYMENT_MODE == "local" else [],
+        "coalesced": {
+            "retrieval": manager.flights.stats(),
+            "answers": resources["qa_engine"].flights.stats()
+        }
+    }
+
+
+@app.get("/metrics")
+async def prometheus_metrics() -> PlainTextResponse:
+    """Per-stage latency histograms and cache hit rates, in Prometheus text format."""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/retrieve")
+async def retrieve(request: QuestionRequest) -> Dict[str, Any]:
+    start_time = time.perf_counter()
+    async with resources["slots"]:
+        docs = await _retriever_for(request.k).ainvoke(request.question)
+    return {
+        "question": request.question,
+        "chunks": [_chunk_json(doc) for doc in docs],
+        "latency_ms": round((time.perf_counter() - start_time) * 1000, 1)
+    }
+
+
+@app.post("/query")
+async def query(request: QuestionRequest) -> Dict[str, Any]:
+    start_time = time.perf_counter()
+    async with resources["slots"]:
+        result = await resources["qa_engine"].aask(request.question, _retriever_for(request.k))
+    return {
+        "question": request.question,
+        **result,
+        "latency_ms": round((time.perf_counter() - start_time) * 1000, 1)
+    }
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host=config.SERVICE_HOST, port=config.SERVICE_PORT)
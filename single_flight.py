@@ -0,0 +1,105 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical calls into one execution.
+
+    The first caller for a key runs the work; callers that arrive with the
+    same key while it runs wait for it and get the same result (or the same
+    exception). Nothing is kept once the call finishes: reusing finished
+    results is the job of the caches. Shared results must be treated as
+    read-only.
+
+    do() coalesces threads (Streamlit sessions, executor workers); ado()
+    coalesces coroutines on one event loop. A cancelled waiter does not
+    cancel the shared work.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Dict[str, Any]] = {}
+        self._tasks: Dict[Tuple[asyncio.AbstractEventLoop, Hashable], asyncio.Future] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def join(self, key: Hashable) -> Tuple[Dict[str, Any], bool]:
+        """Registers a caller; returns (call, is_leader). The leader must finish() the call."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return call, False
+            call = {"done": threading.Event(), "result": None, "error": None, "abandoned": False}
+            self._calls[key] = call
+            self.executions += 1
+            return call, True
+
+    def finish(self, key: Hashable, call: Dict[str, Any], result: Any = None, error: Optional[BaseException] = None) -> None:
+        call["result"], call["error"] = result, error
+        with self._lock:
+            self._calls.pop(key, None)
+        call["done"].set()
+
+    def abandon(self, key: Hashable, call: Dict[str, Any]) -> None:
+        """The leader stopped without a result; waiters will compute their own."""
+        call["abandoned"] = True
+        self.finish(key, call)
+
+    @staticmethod
+    def wait(call: Dict[str, Any]) -> Any:
+        """The leader's result; check call["abandoned"] afterwards."""
+        call["done"].wait()
+        if call["error"] is not None:
+            raise call["error"]
+        return call["result"]
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args: Any) -> Any:
+        call, leader = self.join(key)
+        if not leader:
+            result = self.wait(call)
+            return fn(*args) if call["abandoned"] else result
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result)
+        return result
+
+    async def ado(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args: Any) -> Any:
+        flight_key = (asyncio.get_running_loop(), key)
+        with self._lock:
+            task = self._tasks.get(flight_key)
+            if task is not None:
+                self.coalesced += 1
+            else:
+                task = asyncio.ensure_future(fn(*args))
+                self._tasks[flight_key] = task
+                self.executions += 1
+                task.add_done_callback(lambda done: self._forget(flight_key, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, flight_key: Tuple, task: asyncio.Future) -> None:
+        with self._lock:
+            self._tasks.pop(flight_key, None)
+        if not task.cancelled():
+            # Marks the exception retrieved even if every waiter was cancelled
+            task.exception()
+
+    def record(self, executions: int, coalesced: int) -> None:
+        """Counts calls merged outside do()/ado() (e.g. duplicates within one batch)."""
+        with self._lock:
+            self.executions += executions
+            self.coalesced += coalesced
+
+    def stats(self) -> Dict[str, Any]:
+        calls = self.executions + self.coalesced
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls) + len(self._tasks),
+            "coalesced_rate": self.coalesced / calls if calls else 0.0
+        }
@@ -0,0 +1,236 @@
+import json
+import math
+import mmap
+import os
+import re
+from pathlib import Path
+from typing import List, Dict, Iterable, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+# Keeps decimals ("1.7") and codes ("a1", "2024") whole; everything is lower-cased
+_TERM_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have", "in", "is",
+    "it", "its", "of", "on", "or", "that", "the", "this", "to", "was", "were", "will", "with"
+}
+
+# BM25 parameters (the usual defaults)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    return [term for term in _TERM_PATTERN.findall(text.lower()) if term not in STOP_WORDS]
+
+
+def encode_varints(values: np.ndarray) -> bytes:
+    """LEB128-style varint encoding of non-negative integers (vectorised)."""
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return b""
+    nbytes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        nbytes += rest > 0
+        rest >>= np.uint64(7)
+
+    out = np.empty(int(nbytes.sum()), dtype=np.uint8)
+    offsets = np.cumsum(nbytes) - nbytes
+    for k in range(int(nbytes.max())):
+        mask = nbytes > k
+        byte = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        byte |= np.where(nbytes[mask] > k + 1, np.uint64(0x80), np.uint64(0))
+        out[offsets[mask] + k] = byte.astype(np.uint8)
+    return out.tobytes()
+
+
+def decode_varints(data: bytes) -> np.ndarray:
+    """Inverse of encode_varints."""
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if not len(raw):
+        return np.empty(0, dtype=np.int64)
+    ends = np.flatnonzero(raw < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    shift = np.arange(len(raw)) - np.repeat(starts, ends - starts + 1)
+    parts = (raw & 0x7F).astype(np.uint64) << (7 * shift).astype(np.uint64)
+    return np.add.reduceat(parts, starts).astype(np.int64)
+
+
+class SparseIndex:
+    """
+    BM25 inverted index over chunk text, addressed by the same chunk_ids as the
+    FAISS index.
+
+    Each term's postings are (chunk_id delta, term frequency) pairs, varint
+    encoded. chunk_ids only ever grow, so adding chunks appends to a term's
+    postings without re-encoding them. Files (next to index.faiss):
+        sparse.postings.bin  - every term's encoded postings, back to back
+        sparse.vocab.json    - {term: [offset, length, df, last chunk_id]}
+        sparse.docs.npy      - int64 (2, n): chunk_id (sorted) and token length
+    The postings file is memory-mapped on load; a term is only copied into
+    memory when an update touches it.
+    """
+
+    POSTINGS_NAME = "sparse.postings.bin"
+    VOCAB_NAME = "sparse.vocab.json"
+    DOCS_NAME = "sparse.docs.npy"
+
+    def __init__(self):
+        self._vocab: Dict[str, List[int]] = {}
+        self._blob = b""
+        self._touched: Dict[str, bytearray] = {}
+        self._docs = np.empty((2, 0), dtype=np.int64)
+        self._pending_docs: List[Tuple[int, int]] = []
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return self._docs.shape[1] + len(self._pending_docs)
+
+    def _postings_bytes(self, term: str) -> bytes:
+        if term in self._touched:
+            return bytes(self._touched[term])
+        offset, length, _, _ = self._vocab[term]
+        return self._blob[offset:offset + length]
+
+    def _postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(chunk_ids, term frequencies) for one term."""
+        pairs = decode_varints(self._postings_bytes(term)).reshape(-1, 2)
+        return np.cumsum(pairs[:, 0]), pairs[:, 1]
+
+    def _doc_columns(self) -> np.ndarray:
+        if self._pending_docs:
+            docs = np.concatenate([self._docs, np.asarray(self._pending_docs, dtype=np.int64).T], axis=1)
+            self._docs = docs[:, np.argsort(docs[0], kind="stable")]
+            self._pending_docs = []
+        return self._docs
+
+    # ---- writes ------------------------------------------------------------
+
+    def add(self, chunk_ids: Iterable[int], documents: Iterable[Document]) -> None:
+        """Indexes documents; chunk_ids must be larger than any already indexed."""
+        for chunk_id, doc in zip(chunk_ids, documents):
+            chunk_id = int(chunk_id)
+            terms = tokenize(doc.page_content)
+            self._pending_docs.append((chunk_id, len(terms)))
+            self._total_length += len(terms)
+
+            counts: Dict[str, int] = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                offset, length, df, last = self._vocab.get(term, [0, 0, 0, 0])
+                if term not in self._touched:
+                    self._touched[term] = bytearray(self._postings_bytes(term) if term in self._vocab else b"")
+                self._touched[term] += encode_varints(np.asarray([chunk_id - last, tf]))
+                self._vocab[term] = [offset, length, df + 1, chunk_id]
+
+    def remove(self, chunk_ids: Iterable[int]) -> None:
+        """Drops chunks and re-encodes the affected postings."""
+        removed = np.asarray(sorted(int(i) for i in chunk_ids), dtype=np.int64)
+        docs = self._doc_columns()
+        gone = np.isin(docs[0], removed)
+        if not gone.any():
+            return
+        self._total_length -= int(docs[1, gone].sum())
+        self._docs = docs[:, ~gone]
+
+        for term in list(self._vocab):
+            ids, tfs = self._postings(term)
+            keep = ~np.isin(ids, removed)
+            if keep.all():
+                continue
+            if not keep.any():
+                del self._vocab[term]
+                self._touched.pop(term, None)
+                continue
+            ids, tfs = ids[keep], tfs[keep]
+            deltas = np.diff(ids, prepend=0)
+            self._touched[term] = bytearray(encode_varints(np.column_stack([deltas, tfs]).ravel()))
+            self._vocab[term][2:] = [len(ids), int(ids[-1])]
+
+    # ---- reads -------------------------------------------------------------
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float, int]]:
+        """
+        Top-k chunks by BM25 as (chunk_id, score, number of distinct query terms matched).
+        """
+        docs = self._doc_columns()
+        n_docs = docs.shape[1]
+        terms = [term for term in dict.fromkeys(tokenize(query)) if term in self._vocab]
+        if not terms or not n_docs:
+            return []
+
+        avg_length = max(self._total_length / n_docs, 1.0)
+        all_ids, all_scores = [], []
+        for term in terms:
+            ids, tfs = self._postings(term)
+            pos = np.searchsorted(docs[0], ids)
+            pos[pos >= n_docs] = 0
+            live = docs[0, pos] == ids
+            ids, tfs, lengths = ids[live], tfs[live], docs[1, pos[live]]
+
+            df = self._vocab[term][2]
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_length)
+            all_ids.append(ids)
+            all_scores.append(idf * tfs * (BM25_K1 + 1) / (tfs + norm))
+
+        ids = np.concatenate(all_ids)
+        if not len(ids):
+            return []
+        unique_ids, inverse, matched = np.unique(ids, return_inverse=True, return_counts=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+
+        top = np.argsort(-scores, kind="stable")[:k]
+        return [(int(unique_ids[i]), float(scores[i]), int(matched[i])) for i in top]
+
+    # ---- persistence -------------------------------------------------------
+
+    def save(self, index_path: Path) -> None:
+        index_path = Path(index_path)
+        postings_tmp = index_path / (self.POSTINGS_NAME + ".tmp")
+        vocab = {}
+        offset = 0
+        with open(postings_tmp, 'wb') as f:
+            for term in sorted(self._vocab):
+                data = self._postings_bytes(term)
+                f.write(data)
+                _, _, df, last = self._vocab[term]
+                vocab[term] = [offset, len(data), df, last]
+                offset += len(data)
+
+        vocab_tmp = index_path / (self.VOCAB_NAME + ".tmp")
+        with open(vocab_tmp, 'w', encoding='utf-8') as f:
+            json.dump({"total_length": self._total_length, "terms": vocab}, f, ensure_ascii=False)
+        docs_tmp = index_path / (self.DOCS_NAME + ".tmp")
+        with open(docs_tmp, 'wb') as f:
+            np.save(f, self._doc_columns())
+
+        os.replace(postings_tmp, index_path / self.POSTINGS_NAME)
+        os.replace(vocab_tmp, index_path / self.VOCAB_NAME)
+        os.replace(docs_tmp, index_path / self.DOCS_NAME)
+
+        # Re-open what was just written so the in-memory copies can be dropped
+        loaded = self.load(index_path)
+        self.__dict__.update(loaded.__dict__)
+
+    @classmethod
+    def load(cls, index_path: Path) -> "SparseIndex":
+        """Opens a saved index; indexes built before the sparse side existed load empty."""
+        index_path = Path(index_path)
+        sparse_index = cls()
+        if not (index_path / cls.VOCAB_NAME).exists():
+            return sparse_index
+
+        with open(index_path / cls.VOCAB_NAME, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        sparse_index._vocab = meta["terms"]
+        sparse_index._total_length = meta["total_length"]
+        sparse_index._docs = np.load(index_path / cls.DOCS_NAME)
+        if (index_path / cls.POSTINGS_NAME).stat().st_size:
+            with open(index_path / cls.POSTINGS_NAME, 'rb') as f:
+                sparse_index._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return sparse_index
@@ -0,0 +1,180 @@
+import json
+import math
+import os
+import re
+from collections import defaultdict
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterable, Set
+
+from langchain_core.documents import Document
+from chunker import markdown_table_rows
+
+YEAR_PATTERN = re.compile(r"\b(?:19|20)\d{2}\b")
+
+# Words that carry no meaning when matching a question against a row label
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "did", "do", "does", "for", "from",
+    "how", "in", "is", "it", "its", "much", "of", "on", "s", "the", "to", "was", "were",
+    "what", "which", "will", "with", "year",
+    # Question filler that never names what is being looked up
+    "according", "figure", "give", "me", "number", "please", "report", "show", "tell", "value"
+}
+
+# Questions asking for reasoning rather than a single figure go to the LLM
+NON_LOOKUP_CUES = ("why", "explain", "how did", "how does", "compare", "trend", "change between")
+
+# Minimum cosine overlap between question and row-label words for a direct answer.
+# On top of it, every question word must appear in the row label, the column
+# header or the document's doc_id (e.g. a country), so qualifiers such as
+# "non-oil", "Saudi Arabia" or "downside scenario" send the question to the LLM.
+MIN_MATCH_SCORE = 0.6
+
+
+def _label_tokens(text: str) -> frozenset:
+    return frozenset(
+        word for word in re.findall(r"[a-z]+", text.lower()) if word not in STOP_WORDS and len(word) > 1
+    )
+
+
+class TableIndex:
+    """
+    Small in-memory lookup from (row label, year column) to cell value, built
+    from the table chunks emitted by DocumentProcessor. Lets numeric questions
+    such as "real GDP growth 2024" be answered straight from the table without
+    an LLM call.
+
+    Cells are kept per chunk_id so incremental updates can drop a document's
+    tables, and the whole index is persisted as JSON next to the FAISS index.
+    """
+
+    FILE_NAME = "table_index.json"
+
+    def __init__(self):
+        self._cells: Dict[int, List[Dict[str, Any]]] = {}
+        self._by_year: Optional[Dict[str, List[Dict[str, Any]]]] = None
+
+    def __len__(self) -> int:
+        return sum(len(cells) for cells in self._cells.values())
+
+    @staticmethod
+    def _table_cells(chunk_id: int, doc: Document) -> List[Dict[str, Any]]:
+        """Every (row label, year column, value) cell in one table chunk."""
+        rows = markdown_table_rows(doc.page_content)
+
+        # The header is the first row naming a year (titles often sit above it)
+        header_pos = next((i for i, row in enumerate(rows) if any(YEAR_PATTERN.match(c) for c in row)), None)
+        if header_pos is None:
+            return []
+        header = rows[header_pos]
+        year_columns = [(j, YEAR_PATTERN.match(c).group(0), c) for j, c in enumerate(header) if YEAR_PATTERN.match(c)]
+
+        cells = []
+        for row in rows[header_pos + 1:]:
+            label = row[0] if row else ""
+            if not _label_tokens(label):
+                continue
+            for j, year, column in year_columns:
+                if j < len(row) and row[j]:
+                    cells.append({
+                        "chunk_id": chunk_id,
+                        "row": label,
+                        "column": column,
+                        "year": year,
+                        "value": row[j],
+                        "source": doc.metadata.get("source"),
+                        "doc_id": doc.metadata.get("doc_id"),
+                        "page": doc.metadata.get("page")
+                    })
+        return cells
+
+    def add(self, chunk_ids: Iterable[int], documents: Iterable[Document]) -> None:
+        """Indexes the table chunks among `documents` (other chunks are ignored)."""
+        for chunk_id, doc in zip(chunk_ids, documents):
+            if doc.metadata.get("chunk_type") != "table":
+                continue
+            cells = self._table_cells(int(chunk_id), doc)
+            if cells:
+                self._cells[int(chunk_id)] = cells
+                self._by_year = None
+
+    def remove(self, chunk_ids: Iterable[int]) -> None:
+        for chunk_id in chunk_ids:
+            if self._cells.pop(int(chunk_id), None) is not None:
+                self._by_year = None
+
+    def _year_buckets(self) -> Dict[str, List[Dict[str, Any]]]:
+        if self._by_year is None:
+            self._by_year = defaultdict(list)
+            for cells in self._cells.values():
+                for cell in cells:
+                    # Indexes saved before doc_id was stored: the file name stands in for it
+                    doc_id = cell.get("doc_id") or Path(cell.get("source") or "").stem
+                    self._by_year[cell["year"]].append({
+                        **cell,
+                        "tokens": _label_tokens(cell["row"]),
+                        "context": _label_tokens(cell["column"]) | _label_tokens(doc_id.replace("_", " "))
+                    })
+        return self._by_year
+
+    def lookup(self, question: str, chunk_ids: Optional[Iterable[int]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Returns the cell answering `question`, or None when the question is not
+        a single-figure lookup, a question word is not covered by a cell's row
+        label, column or doc_id, no row label matches well enough, or two tables
+        disagree on the value. With chunk_ids, only those table chunks (e.g. the
+        ones retrieved for the question) are considered.
+        """
+        lowered = question.lower()
+        if any(cue in lowered for cue in NON_LOOKUP_CUES):
+            return None
+        years = set(YEAR_PATTERN.findall(question))
+        if len(years) != 1:
+            return None
+        year = years.pop()
+
+        question_tokens = _label_tokens(question)
+        if not question_tokens:
+            return None
+        allowed: Optional[Set[int]] = None if chunk_ids is None else {int(chunk_id) for chunk_id in chunk_ids if chunk_id is not None}
+
+        best_score, matches = 0.0, []
+        for cell in self._year_buckets().get(year, []):
+            if allowed is not None and cell["chunk_id"] not in allowed:
+                continue
+            if not question_tokens <= cell["tokens"] | cell["context"]:
+                continue
+            # Words answered by the column or doc_id don't count against the row label
+            asked = question_tokens - (cell["context"] - cell["tokens"])
+            overlap = len(asked & cell["tokens"])
+            if not overlap:
+                continue
+            score = overlap / math.sqrt(len(asked) * len(cell["tokens"]))
+            if score > best_score:
+                best_score, matches = score, [cell]
+            elif score == best_score:
+                matches.append(cell)
+
+        if best_score < MIN_MATCH_SCORE or len({cell["value"] for cell in matches}) != 1:
+            return None
+        answer = {k: v for k, v in matches[0].items() if k not in ("tokens", "context")}
+        answer["score"] = round(best_score, 3)
+        return answer
+
+    def save(self, index_path: Path) -> None:
+        path = Path(index_path) / self.FILE_NAME
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"cells": [cell for cells in self._cells.values() for cell in cells]}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, index_path: Path) -> "TableIndex":
+        """Reads a saved index; indexes built before table chunks existed load empty."""
+        table_index = cls()
+        path = Path(index_path) / cls.FILE_NAME
+        if not path.exists():
+            return table_index
+        with open(path, 'r', encoding='utf-8') as f:
+            for cell in json.load(f)["cells"]:
+                table_index._cells.setdefault(cell["chunk_id"], []).append(cell)
+        return table_index
@@ -1,101 +1,758 @@
+import asyncio
 import json
+import os
 import shutil
+import sys
+import time
+import uuid
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, Iterator
 
+import faiss
+import numpy as np
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
 from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from chunk_store import ChunkStore, ChunkIdMap
+from embedding_cache import EmbeddingCache
+from query_cache import QueryCache, normalize_query
+from single_flight import SingleFlight
+from sparse_index import SparseIndex, tokenize
+from table_index import TableIndex
+import metrics
 import config
 
+MANIFEST_NAME = "manifest.json"
+INDEX_FILE_NAME = "index.faiss"
+# Written by FAISS.save_local in older builds; only read by migrate_legacy_index
+LEGACY_DOCSTORE_NAME = "index.pkl"
+# Every save writes its files into a new <prefix><version> directory (see _save_to_disk)
+GENERATION_PREFIX = "gen-"
+
+def _approx_token_count(text: str) -> int:
+    """Cheap token-length proxy used to group similarly sized chunks into one batch."""
+    return len(text.split())
+
+
 class VectorStoreManager:
-    def __init__(self):
+    def __init__(self, use_cache: bool = True):
         self.index_path = config.VECTOR_STORE_PATH
+
+        # Cap intra-op threads before the model is loaded (0 keeps torch's default)
+        if config.EMBEDDING_THREADS > 0:
+            import torch
+            torch.set_num_threads(config.EMBEDDING_THREADS)
+
         self.embeddings = HuggingFaceEmbeddings(
             model_name=config.EMBEDDING_MODEL_NAME,
             model_kwargs={'device': config.EMBEDDING_DEVICE},
-            encode_kwargs={'normalize_embeddings': True}
+            encode_kwargs={'normalize_embeddings': True, 'batch_size': config.EMBEDDING_BATCH_SIZE}
         )
         self.vectorstore = None
+        self.load_mode = "ram"
+        # next_chunk_id keeps chunk_ids stable across incremental updates
+        self.manifest = {"next_chunk_id": 0, "version": None}
+        # Content-hash -> vector cache so re-indexing only embeds new or changed text
+        self.embedding_cache = (
+            EmbeddingCache(config.EMBEDDING_CACHE_DIR, config.EMBEDDING_MODEL_NAME) if use_cache else None
+        )
+        # (row label, year) -> cell lookup over the indexed table chunks
+        self.table_index = TableIndex()
+        # BM25 postings over the same chunk_ids, for hybrid retrieval
+        self.sparse_index = SparseIndex()
+        # Cross-encoder, loaded on first use when RERANK_ENABLED
+        self.reranker = None
+        # Repeated questions skip the query embedding and, for an unchanged index, the search
+        self.query_cache = QueryCache(
+            config.EMBEDDING_MODEL_NAME,
+            config.QUERY_CACHE_SIZE,
+            config.QUERY_CACHE_PATH if config.QUERY_CACHE_PERSIST else None
+        )
+        # Concurrent identical questions share one search
+        self.flights = SingleFlight()
+        # Query cache hit rates and coalesced searches are exported with the stage latencies (see metrics.py)
+        metrics.REGISTRY.register_collector("query_cache", self.query_cache.stats)
+        metrics.REGISTRY.register_flights("retrieval", self.flights.stats)
+        # Build-time state: batches buffered until a trained index can be created,
+        # plus held-out sample queries and their running exact top-k for the recall@k report
+        self._index_type = config.FAISS_INDEX_TYPE
+        self._pending = []
+        self._pending_count = 0
+        self._eval_k = 10
+        self._eval_queries = None
+        self._eval_query_ids = None
+        self._exact_topk = None
+        # Embedding throughput counters for the current build
+        self._embedded_count = 0
+        self._embedding_seconds = 0.0
+        self._cache_hits = 0
 
-    def create_vector_store(self, chunks_data: Optional[List[Dict]] = None) -> None:
+    @staticmethod
+    def _iter_chunks(chunks_path: Path) -> Iterator[Dict]:
+        """Streams chunks from the JSON Lines file written by DocumentProcessor.save_chunks."""
+        with open(chunks_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def create_vector_store(self, chunks_data: Optional[Iterable[Dict]] = None) -> None:
         """
         Creates a FAISS vector store from text chunks.
-        If chunks_data is None, it loads from the processed JSON file.
+        If chunks_data is None, it streams from the processed JSONL file.
+        Chunks are embedded and indexed in batches so the raw chunk list is
+        never materialised in memory.
         """
-        # 1. Load data if not provided
-        if not chunks_data:
+        # 1. Stream data if not provided
+        if chunks_data is None:
             if not config.CHUNKS_PATH.exists():
                 raise FileNotFoundError(f"No chunks found at {config.CHUNKS_PATH}. Run document_processor.py first.")
             
-            print(f"Loading chunks from {config.CHUNKS_PATH}...")
-            with open(config.CHUNKS_PATH, 'r', encoding='utf-8') as f:
-                chunks_data = json.load(f)
+            print(f"Streaming chunks from {config.CHUNKS_PATH}...")
+            chunks_data = self._iter_chunks(config.CHUNKS_PATH)
+
+        print(f"Generating embeddings using {config.EMBEDDING_MODEL_NAME}...")
+        print(f"   (This runs locally on {config.EMBEDDING_DEVICE}, no API cost)")
+
+        # 2. Build the index batch by batch
+        self.vectorstore = None
+        self.manifest = {"next_chunk_id": 0, "version": None}
+        self.table_index = TableIndex()
+        self.sparse_index = SparseIndex()
+        chunk_ids = self._index_chunks(chunks_data)
+        if not chunk_ids:
+            print("No documents to index.")
+            return
+
+        # 3. Save to Disk
+        self._save_to_disk()
+        print(f"Vector store saved to {self.index_path}")
+
+    def add_documents(self, chunks_data: Iterable[Dict]) -> List[int]:
+        """
+        Embeds new chunks and appends them to the persisted index in place.
+        Existing vectors are untouched and new chunks continue the chunk_id sequence.
+        """
+        if not self.vectorstore or self.load_mode != "ram":
+            # Updates need a writable, in-memory copy of the FAISS index
+            self.load_vector_store(mode="ram")
+
+        chunk_ids = self._index_chunks(chunks_data)
+        if chunk_ids:
+            self._save_to_disk()
+            print(f"Added {len(chunk_ids)} chunks to {self.index_path}")
+        return chunk_ids
+
+    def remove_document(self, source: str) -> int:
+        """
+        Deletes every chunk whose metadata 'source' (file name) or 'doc_id' matches,
+        from both the FAISS index and the docstore, and persists the result.
+        Returns the number of chunks removed.
+        """
+        if not self.vectorstore or self.load_mode != "ram":
+            # Updates need a writable, in-memory copy of the FAISS index
+            self.load_vector_store(mode="ram")
+
+        docstore = self.vectorstore.docstore
+        chunk_ids = docstore.find(source)
+
+        if not chunk_ids:
+            print(f"No chunks found for '{source}'.")
+            return 0
+
+        index = self.vectorstore.index
+        if isinstance(index, faiss.IndexIDMap2) and isinstance(faiss.downcast_index(index.index), faiss.IndexHNSW):
+            raise ValueError("HNSW indexes do not support deletion. Rebuild the index with --force instead.")
+
+        self.vectorstore.index.remove_ids(np.asarray(chunk_ids, dtype=np.int64))
+        docstore.delete([str(chunk_id) for chunk_id in chunk_ids])
+        self.table_index.remove(chunk_ids)
+        self.sparse_index.remove(chunk_ids)
+
+        self._save_to_disk()
+        print(f"Removed {len(chunk_ids)} chunks for '{source}' from {self.index_path}")
+        return len(chunk_ids)
+
+    def _index_chunks(self, chunks_data: Iterable[Dict]) -> List[int]:
+        """Converts chunks to Documents, assigns chunk_ids and indexes them in batches."""
+        self._embedded_count = 0
+        self._embedding_seconds = 0.0
+        self._cache_hits = 0
+        chunk_ids = []
+        batch = []
 
-        # 2. Convert to LangChain Documents
         # document_processor.py outputs 'page_content', ensuring compatibility here.
-        documents = []
-        for i, chunk in enumerate(chunks_data):
+        for chunk in chunks_data:
             doc = Document(
                 page_content=chunk.get("page_content", ""),
                 metadata=chunk.get("metadata", {})
             )
-            # Add a unique ID to metadata for reference
-            doc.metadata["chunk_id"] = i
-            documents.append(doc)
+            # Add a unique, stable ID to metadata for reference (also the FAISS vector ID)
+            doc.metadata["chunk_id"] = self.manifest["next_chunk_id"]
+            self.manifest["next_chunk_id"] += 1
+            chunk_ids.append(doc.metadata["chunk_id"])
+            batch.append(doc)
 
-        if not documents:
-            print("No documents to index.")
+            if len(batch) >= config.INDEX_BATCH_SIZE:
+                self._index_batch(batch)
+                print(f"   - Indexed {len(chunk_ids)} chunks...", end="\r")
+                batch = []
+
+        if batch:
+            self._index_batch(batch)
+        # Small corpora may never fill the training buffer
+        self._flush_pending()
+
+        if chunk_ids:
+            total = len(chunk_ids)
+            print(f"\nIndexed {total} chunks.")
+            if self._embedding_seconds > 0:
+                rate = self._embedded_count / self._embedding_seconds
+                print(f"   - Embedding throughput: {rate:.1f} chunks/sec ({self._embedding_seconds:.2f}s total)")
+            if self.embedding_cache is not None:
+                print(f"   - Reused {self._cache_hits}/{total} embeddings from cache")
+            self._report_index_quality()
+        return chunk_ids
+
+    def _embed_documents(self, documents: List[Document]) -> List[List[float]]:
+        """
+        Embeds documents in batches of EMBEDDING_BATCH_SIZE.
+        Vectors already in the embedding cache are reused; the remaining chunks are
+        sorted by token length so each batch pads to a similar length, and the
+        vectors are returned in the original order.
+        """
+        vectors: List[Optional[List[float]]] = [None] * len(documents)
+
+        keys = []
+        if self.embedding_cache is not None:
+            keys = [self.embedding_cache.key(doc.page_content) for doc in documents]
+            for i, vector in self.embedding_cache.get_many(keys).items():
+                vectors[i] = vector
+            self._cache_hits += len(documents) - vectors.count(None)
+            metrics.record_cache("embedding_cache", len(documents) - vectors.count(None), vectors.count(None))
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if not missing:
+            return vectors
+        order = sorted(missing, key=lambda i: _approx_token_count(documents[i].page_content))
+
+        start_time = time.perf_counter()
+        batch_size = config.EMBEDDING_BATCH_SIZE
+        for start in range(0, len(order), batch_size):
+            batch_ids = order[start:start + batch_size]
+            with metrics.timed("document_embedding"):
+                batch_vectors = self.embeddings.embed_documents([documents[i].page_content for i in batch_ids])
+            for i, vector in zip(batch_ids, batch_vectors):
+                vectors[i] = vector
+
+        self._embedding_seconds += time.perf_counter() - start_time
+        self._embedded_count += len(missing)
+
+        if self.embedding_cache is not None:
+            self.embedding_cache.add_many([keys[i] for i in missing], [vectors[i] for i in missing])
+        return vectors
+
+    def _index_batch(self, documents: List[Document]) -> None:
+        """Embeds one batch of documents and appends it to the index under their chunk_ids."""
+        vectors = np.asarray(self._embed_documents(documents), dtype=np.float32)
+        chunk_ids = np.asarray([doc.metadata["chunk_id"] for doc in documents], dtype=np.int64)
+
+        if self.vectorstore is None:
+            # Trained index families need a sample before the index can be built
+            self._pending.append((vectors, chunk_ids, documents))
+            self._pending_count += len(documents)
+            if config.FAISS_INDEX_TYPE == "flat" or self._pending_count >= config.FAISS_TRAIN_SIZE:
+                self._flush_pending()
             return
 
-        # 3. Build Index
-        print(f"Generating embeddings for {len(documents)} chunks using {config.EMBEDDING_MODEL_NAME}...")
-        print(f"   (This runs locally on {config.EMBEDDING_DEVICE}, no API cost)")
-        
-        self.vectorstore = FAISS.from_documents(
-            documents=documents,
-            embedding=self.embeddings
+        self._add_vectors(vectors, chunk_ids, documents)
+
+    def _add_vectors(self, vectors: np.ndarray, chunk_ids: np.ndarray, documents: List[Document]) -> None:
+        self.vectorstore.index.add_with_ids(vectors, chunk_ids)
+        self.vectorstore.docstore.add({str(chunk_id): doc for chunk_id, doc in zip(chunk_ids.tolist(), documents)})
+        self.table_index.add(chunk_ids.tolist(), documents)
+        self.sparse_index.add(chunk_ids.tolist(), documents)
+        if self._eval_queries is not None:
+            self._update_exact_topk(vectors, chunk_ids)
+
+    def _update_exact_topk(self, vectors: np.ndarray, chunk_ids: np.ndarray) -> None:
+        """
+        Brute-force search of the eval queries over one added batch, merged into
+        the running exact top-k. Memory stays at queries x k however big the
+        corpus, instead of a second (uncompressed) copy of every vector.
+        """
+        distances = (
+            (self._eval_queries ** 2).sum(axis=1)[:, None]
+            + (vectors ** 2).sum(axis=1)[None, :]
+            - 2 * self._eval_queries @ vectors.T
         )
-        
-        # 4. Save to Disk
-        self._save_to_disk()
-        print(f"Vector store saved to {self.index_path}")
+        ids = np.broadcast_to(chunk_ids, distances.shape)
+        # A query is held out: its own chunk is never one of its neighbours
+        distances = np.where(ids == self._eval_query_ids[:, None], np.inf, distances)
+
+        best_distances, best_ids = self._exact_topk
+        distances = np.concatenate([best_distances, distances], axis=1)
+        ids = np.concatenate([best_ids, ids], axis=1)
+        keep = np.argsort(distances, axis=1, kind="stable")[:, :self._eval_k]
+        self._exact_topk = (np.take_along_axis(distances, keep, axis=1), np.take_along_axis(ids, keep, axis=1))
+
+    def _flush_pending(self) -> None:
+        """Builds (and trains) the index from the buffered batches, then adds them."""
+        if not self._pending:
+            return
+        sample = np.concatenate([vectors for vectors, _, _ in self._pending])
+
+        # Vector IDs are chunk_ids, so deletes never renumber the remaining chunks.
+        # The new chunk store only replaces the published one when it is flushed.
+        self.index_path.mkdir(parents=True, exist_ok=True)
+        chunk_store = ChunkStore(self.index_path, create=True)
+        self.vectorstore = FAISS(
+            embedding_function=self.embeddings,
+            index=self._build_index(sample),
+            docstore=chunk_store,
+            index_to_docstore_id=ChunkIdMap(chunk_store)
+        )
+        self.manifest["index_type"] = self._index_type
+
+        # Eval queries for the recall report, with an exact top-k filled in as vectors are added
+        if self._index_type != "flat" and config.FAISS_EVAL_QUERIES > 0:
+            sample_ids = np.concatenate([chunk_ids for _, chunk_ids, _ in self._pending])
+            step = max(1, len(sample) // config.FAISS_EVAL_QUERIES)
+            self._eval_queries = sample[::step][:config.FAISS_EVAL_QUERIES].copy()
+            self._eval_query_ids = sample_ids[::step][:config.FAISS_EVAL_QUERIES].copy()
+            self._exact_topk = (
+                np.full((len(self._eval_queries), 0), np.inf, dtype=np.float32),
+                np.empty((len(self._eval_queries), 0), dtype=np.int64)
+            )
+
+        for vectors, chunk_ids, documents in self._pending:
+            self._add_vectors(vectors, chunk_ids, documents)
+        self._pending = []
+        self._pending_count = 0
+
+    def _build_index(self, sample: np.ndarray):
+        """
+        Creates the FAISS index family selected by config.FAISS_INDEX_TYPE.
+        IVF variants are trained on `sample`; if it is too small to train them
+        the build falls back to an exact flat index.
+        """
+        dim = sample.shape[1]
+        index_type = config.FAISS_INDEX_TYPE
+        if index_type not in ("flat", "ivf", "hnsw", "ivfpq"):
+            raise ValueError(f"Unknown FAISS_INDEX_TYPE '{index_type}'. Use flat, ivf, hnsw or ivfpq.")
+
+        # faiss wants ~39 training points per centroid
+        nlist = min(config.FAISS_IVF_NLIST, len(sample) // 39)
+        if index_type == "ivfpq" and len(sample) < 2 ** config.FAISS_PQ_NBITS:
+            nlist = 0
+        if index_type in ("ivf", "ivfpq") and nlist < 1:
+            print(f"   - Only {len(sample)} vectors: too few to train '{index_type}', using a flat index instead")
+            index_type = "flat"
+        self._index_type = index_type
+
+        if index_type == "flat":
+            return faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+
+        if index_type == "hnsw":
+            hnsw = faiss.IndexHNSWFlat(dim, config.FAISS_HNSW_M)
+            hnsw.hnsw.efConstruction = config.FAISS_HNSW_EF_CONSTRUCTION
+            self._apply_search_params(hnsw)
+            return faiss.IndexIDMap2(hnsw)
+
+        # IVF families store explicit IDs natively, no IDMap wrapper needed
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, config.FAISS_PQ_M, config.FAISS_PQ_NBITS)
+
+        print(f"   - Training {index_type} index ({nlist} lists) on {len(sample)} vectors...")
+        index.train(sample)
+        self._apply_search_params(index)
+        return index
+
+    @staticmethod
+    def _apply_search_params(index) -> None:
+        """Applies query-time knobs (nprobe / efSearch), which are not tied to the build."""
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            ivf.nprobe = config.FAISS_IVF_NPROBE
+
+        base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+        if isinstance(base, faiss.IndexHNSW):
+            base.hnsw.efSearch = config.FAISS_HNSW_EF_SEARCH
+
+    def _report_index_quality(self) -> None:
+        """
+        Prints recall@k against brute-force search and per-query latency for the built index.
+
+        Each sample query is a chunk vector held out of its own results (its chunk
+        is skipped in both rankings), so a query never trivially finds itself.
+        """
+        if self._eval_queries is None or self._exact_topk is None:
+            return
+
+        queries, query_ids = self._eval_queries, self._eval_query_ids
+        exact_ids = self._exact_topk[1]
+        k = min(self._eval_k, self.vectorstore.index.ntotal - 1)
+        if k < 1:
+            return
+
+        latencies, recalls = [], []
+        for query, query_id, exact in zip(queries, query_ids.tolist(), exact_ids.tolist()):
+            start = time.perf_counter()
+            _, ids = self.vectorstore.index.search(query[None, :], k + 1)
+            latencies.append((time.perf_counter() - start) * 1000)
+            ann = [chunk_id for chunk_id in ids[0].tolist() if chunk_id not in (query_id, -1)][:k]
+            exact = [chunk_id for chunk_id in exact if chunk_id != query_id][:k]
+            recalls.append(len(set(ann) & set(exact)) / k)
+        latencies = np.asarray(latencies)
+
+        print(f"   - {self._index_type} index quality over {len(queries)} held-out sample queries:")
+        print(f"     recall@{k}: {np.mean(recalls):.3f}")
+        print(f"     latency: {np.mean(latencies):.2f} ms mean / {np.percentile(latencies, 95):.2f} ms p95")
+
+        self._eval_queries = None
+        self._eval_query_ids = None
+        self._exact_topk = None
 
     def _save_to_disk(self):
-        """Saves the FAISS index to the config path."""
-        # FAISS save_local creates a folder, so we point to the parent directory 
-        # and give it the folder name defined in config
+        """
+        Saves the FAISS index, chunk store, table and sparse indexes and a small manifest (no pickles).
+
+        The files go into a new generation directory, and replacing manifest.json
+        (atomic rename) is what publishes it. A reader that opens the manifest
+        and then the generation it names never pairs files from two different
+        saves, e.g. new chunk text with old offsets.
+        """
         if self.vectorstore:
-            self.vectorstore.save_local(str(self.index_path))
+            previous = self._load_manifest().get("generation") if (self.index_path / MANIFEST_NAME).exists() else None
+            version = uuid.uuid4().hex
+            generation = f"{GENERATION_PREFIX}{version}"
+            data_dir = self.index_path / generation
+            data_dir.mkdir(parents=True)
+
+            faiss.write_index(self.vectorstore.index, str(data_dir / INDEX_FILE_NAME))
+            self.vectorstore.docstore.flush(data_dir)
+            self.table_index.save(data_dir)
+            self.sparse_index.save(data_dir)
+
+            # The pickled docstore of older builds no longer matches the index
+            (self.index_path / LEGACY_DOCSTORE_NAME).unlink(missing_ok=True)
+
+            # Fresh token on every save so readers can tell the index changed
+            self.manifest.update({"version": version, "generation": generation})
+            manifest_tmp = self.index_path / (MANIFEST_NAME + ".tmp")
+            with open(manifest_tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.manifest, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(manifest_tmp, self.index_path / MANIFEST_NAME)
+
+            self._prune_generations(generation, previous)
+
+    def _prune_generations(self, current: str, previous: Optional[str]) -> None:
+        """
+        Deletes generations older than the previous one, which is kept for readers
+        that read the old manifest but have not opened its files yet. Loaded
+        readers hold their files open, so deleting them does not affect them.
+        """
+        for path in self.index_path.glob(f"{GENERATION_PREFIX}*"):
+            if path.is_dir() and path.name not in (current, previous):
+                shutil.rmtree(path, ignore_errors=True)
+        if previous is not None:
+            # Builds before generations wrote their files next to the manifest
+            for name in (
+                INDEX_FILE_NAME, ChunkStore.DATA_NAME, ChunkStore.INDEX_NAME, ChunkStore.DOCS_NAME,
+                TableIndex.FILE_NAME, SparseIndex.POSTINGS_NAME, SparseIndex.VOCAB_NAME, SparseIndex.DOCS_NAME
+            ):
+                (self.index_path / name).unlink(missing_ok=True)
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        with open(self.index_path / MANIFEST_NAME, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _data_dir(self, manifest: Dict[str, Any]) -> Path:
+        """Directory of the generation the manifest publishes (older builds: the index folder itself)."""
+        generation = manifest.get("generation")
+        return self.index_path / generation if generation else self.index_path
 
-    def load_vector_store(self):
-        """Loads the FAISS index from disk."""
+    @staticmethod
+    def _mmap_io_flags(index_type: str) -> int:
+        """IVF lists map via IO_FLAG_MMAP; flat/HNSW codes need IO_FLAG_MMAP_IFC (faiss >= 1.11)."""
+        if index_type in ("ivf", "ivfpq"):
+            return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        if not hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+            print(f"   - faiss {faiss.__version__} cannot memory-map {index_type} indexes; loading into RAM (needs faiss >= 1.11)")
+            return faiss.IO_FLAG_READ_ONLY
+        return faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+
+    def load_vector_store(self, mode: Optional[str] = None):
+        """
+        Loads the FAISS index from disk.
+
+        Page text is never loaded up front: the ChunkStore keeps only chunk IDs
+        and a small document table in memory and reads the top-k hits on demand.
+        mode="ram" (default) reads the FAISS index into memory.
+        mode="mmap" memory-maps it instead (IVF inverted lists; flat and HNSW
+        codes need faiss >= 1.11), so worker processes share pages through
+        the OS cache and startup time does not grow with the index. A mapped
+        index is read-only.
+        """
+        mode = mode or config.INDEX_LOAD_MODE
         if not self.index_path.exists():
             raise FileNotFoundError(f"Index not found at {self.index_path}. Create it first.")
-            
-        print(f"Loading vector store from {self.index_path}...")
-        self.vectorstore = FAISS.load_local(
-            str(self.index_path),
-            self.embeddings,
-            allow_dangerous_deserialization=True
+
+        # The manifest is read first and names the generation every other file comes from
+        manifest = self._load_manifest() if (self.index_path / MANIFEST_NAME).exists() else {}
+        data_dir = self._data_dir(manifest)
+        if not ChunkStore.exists(data_dir):
+            if (self.index_path / LEGACY_DOCSTORE_NAME).exists():
+                raise ValueError(
+                    f"Index at {self.index_path} uses the legacy pickled docstore. "
+                    "Convert it once with 'python vector_store.py --migrate-legacy' or rebuild it with --force."
+                )
+            raise FileNotFoundError(f"Chunk store missing in {self.index_path}. Rebuild the index with --force.")
+
+        print(f"Loading vector store from {data_dir} ({mode})...")
+        index_file = str(data_dir / INDEX_FILE_NAME)
+        if mode == "mmap":
+            index = faiss.read_index(index_file, self._mmap_io_flags(manifest.get("index_type", "flat")))
+        else:
+            index = faiss.read_index(index_file)
+        chunk_store = ChunkStore(data_dir)
+        self.vectorstore = FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=chunk_store,
+            index_to_docstore_id=ChunkIdMap(chunk_store)
         )
+        self.load_mode = mode
+        self._apply_search_params(self.vectorstore.index)
+        self.manifest = manifest
+        self.table_index = TableIndex.load(data_dir)
+        self.sparse_index = SparseIndex.load(data_dir)
+        if not len(self.sparse_index) and config.RETRIEVAL_MODE == "hybrid":
+            print("   - No sparse index found (built by an older version); retrieval is dense-only until a rebuild")
         return self.vectorstore
 
+    def migrate_legacy_index(self) -> int:
+        """
+        One-off conversion of an index saved by FAISS.save_local (positional IDs,
+        pickled docstore) into the chunk_id-addressed index + ChunkStore layout.
+        Only run this on an index you built yourself: it unpickles index.pkl.
+        """
+        import pickle
+
+        with open(self.index_path / LEGACY_DOCSTORE_NAME, 'rb') as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        legacy_index = faiss.read_index(str(self.index_path / INDEX_FILE_NAME))
+
+        positions = sorted(index_to_docstore_id)
+        vectors = legacy_index.reconstruct_n(0, legacy_index.ntotal)[positions]
+        documents = [docstore.search(index_to_docstore_id[pos]) for pos in positions]
+        # Legacy builds stamped chunk_id = position; keep it where present
+        chunk_ids = np.asarray(
+            [doc.metadata.get("chunk_id", pos) for pos, doc in zip(positions, documents)], dtype=np.int64
+        )
+        for chunk_id, doc in zip(chunk_ids.tolist(), documents):
+            doc.metadata["chunk_id"] = chunk_id
+            # Legacy builds were single-PDF, so the file stem is the doc_id
+            doc.metadata.setdefault("doc_id", Path(doc.metadata.get("source", "")).stem)
+
+        chunk_store = ChunkStore(self.index_path, create=True)
+        self.vectorstore = FAISS(
+            embedding_function=self.embeddings,
+            index=faiss.IndexIDMap2(faiss.IndexFlatL2(legacy_index.d)),
+            docstore=chunk_store,
+            index_to_docstore_id=ChunkIdMap(chunk_store)
+        )
+        self._add_vectors(np.ascontiguousarray(vectors, dtype=np.float32), chunk_ids, documents)
+        self.manifest = {"next_chunk_id": int(chunk_ids.max()) + 1 if len(chunk_ids) else 0, "version": None, "index_type": "flat"}
+        self.load_mode = "ram"
+        self._save_to_disk()
+        print(f"Migrated {len(documents)} chunks in {self.index_path} to the chunk store layout.")
+        return len(documents)
+
+    def embed_query(self, query: str) -> List[float]:
+        """Query embedding, served from the query cache when the question was seen before."""
+        vector = self.query_cache.get_embedding(query)
+        if vector is None:
+            with metrics.timed("query_embedding"):
+                vector = self.embeddings.embed_query(query)
+            self.query_cache.put_embedding(query, vector)
+        return vector
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Embeds many queries in one batched model call; cached queries are not re-encoded."""
+        if len(queries) == 1:
+            return [self.embed_query(queries[0])]
+        vectors = [self.query_cache.get_embedding(query) for query in queries]
+        missing = list(dict.fromkeys(query for query, vector in zip(queries, vectors) if vector is None))
+        if missing:
+            with metrics.timed("query_embedding"):
+                new_vectors = dict(zip(missing, self.embeddings.embed_documents(missing)))
+            for query, vector in new_vectors.items():
+                self.query_cache.put_embedding(query, vector)
+            vectors = [vector if vector is not None else new_vectors[query] for query, vector in zip(queries, vectors)]
+        return vectors
+
+    def _dense_search_batch(self, queries: List[str], k: int) -> List[List[int]]:
+        """chunk_ids of the k nearest chunks per query, from a single FAISS search (vector IDs are chunk_ids)."""
+        if not queries:
+            return []
+        vectors = np.asarray(self.embed_queries(queries), dtype=np.float32)
+        with metrics.timed("faiss_search"):
+            _, ids = self.vectorstore.index.search(vectors, k)
+        return [[int(i) for i in row if i != -1] for row in ids]
+
+    @staticmethod
+    def _sparse_shortcut(query: str, sparse_hits: List, k: int) -> Optional[List[int]]:
+        """
+        The top-k BM25 chunk_ids when a short keyword query is fully matched by
+        each of them, in which case dense search would add nothing.
+        """
+        n_terms = len(set(tokenize(query)))
+        if (
+            0 < n_terms <= config.SPARSE_SHORTCUT_MAX_TERMS
+            and len(sparse_hits) >= k
+            and all(matched == n_terms for _, _, matched in sparse_hits[:k])
+        ):
+            return [chunk_id for chunk_id, _, _ in sparse_hits[:k]]
+        return None
+
+    @staticmethod
+    def _fuse(rankings: List[List[int]], k: int) -> List[int]:
+        """Reciprocal-rank fusion of several chunk_id rankings."""
+        fused: Dict[int, float] = {}
+        for ranking in rankings:
+            for rank, chunk_id in enumerate(ranking):
+                fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (config.RRF_K + rank + 1)
+        return sorted(fused, key=fused.get, reverse=True)[:k]
+
+    def _fetch_documents(self, chunk_ids: List[int]) -> List[Document]:
+        docs = [self.vectorstore.docstore.search(str(chunk_id)) for chunk_id in chunk_ids]
+        return [doc for doc in docs if isinstance(doc, Document)]
+
+    def _search(self, queries: List[str], k: int = None) -> List[List[Document]]:
+        """
+        Top-k chunks for each query.
+
+        1. Hybrid mode (RETRIEVAL_MODE) ranks with BM25 first; short keyword
+           queries that BM25 fully matches skip dense search.
+        2. Every query that needs dense search is embedded in one batched model
+           call and searched in one FAISS call, then fused with BM25 (RRF).
+        3. With RERANK_ENABLED, RERANK_FETCH_K candidates are cross-encoder reranked.
+        Result chunk_ids are cached per index version (except a rerank that hit
+        its latency cap, so one slow query doesn't pin an un-reranked top-k).
+        """
+        if not self.vectorstore:
+            self.load_vector_store()
+        k = k or config.RETRIEVAL_K
+        hybrid = config.RETRIEVAL_MODE == "hybrid"
+
+        params = f"{config.RETRIEVAL_MODE}|{k}|{config.RERANK_ENABLED}"
+        version = self.manifest.get("version")
+        cached = [self.query_cache.get_results(query, params, version) for query in queries]
+        pending = [i for i, ids in enumerate(cached) if ids is None]
+
+        fetch_k = max(k, config.RERANK_FETCH_K) if config.RERANK_ENABLED else k
+        search_k = max(fetch_k, config.HYBRID_FETCH_K) if hybrid else fetch_k
+        candidates: Dict[int, List[int]] = {}
+        sparse_hits: Dict[int, List] = {}
+        if hybrid:
+            for i in pending:
+                with metrics.timed("bm25_search"):
+                    sparse_hits[i] = self.sparse_index.search(queries[i], search_k)
+                shortcut = self._sparse_shortcut(queries[i], sparse_hits[i], fetch_k)
+                if shortcut is not None:
+                    candidates[i] = shortcut
+
+        need_dense = [i for i in pending if i not in candidates]
+        for i, dense_ids in zip(need_dense, self._dense_search_batch([queries[i] for i in need_dense], search_k)):
+            if hybrid:
+                candidates[i] = self._fuse([dense_ids, [chunk_id for chunk_id, _, _ in sparse_hits[i]]], fetch_k)
+            else:
+                candidates[i] = dense_ids
+
+        results = []
+        for i, query in enumerate(queries):
+            if cached[i] is not None:
+                results.append(self._fetch_documents(cached[i]))
+                continue
+            docs = self._fetch_documents(candidates[i])
+            reranked = True
+            if config.RERANK_ENABLED:
+                if self.reranker is None:
+                    from reranker import Reranker
+                    self.reranker = Reranker()
+                with metrics.timed("rerank"):
+                    docs, reranked = self.reranker.rerank(query, docs, k)
+            if reranked:
+                self.query_cache.put_results(query, params, version, [doc.metadata["chunk_id"] for doc in docs])
+            results.append(docs)
+        return results
+
+    def retrieve_batch(self, queries: List[str], k: int = None) -> List[List[Document]]:
+        """Top-k chunks for each query (see _search); repeated questions in the batch are searched once."""
+        keys = [normalize_query(query) for query in queries]
+        first: Dict[str, int] = {}
+        for i, key in enumerate(keys):
+            first.setdefault(key, i)
+        unique = sorted(first.values())
+        self.flights.record(executions=len(unique), coalesced=len(queries) - len(unique))
+        with metrics.timed("retrieval"):
+            unique_results = dict(zip(unique, self._search([queries[i] for i in unique], k)))
+        return [unique_results[first[key]] for key in keys]
+
+    def retrieve(self, query: str, k: int = None) -> List[Document]:
+        """
+        Top-k chunks for one query (see _search). Concurrent calls for the same
+        question share one search (single-flight).
+        """
+        k = k or config.RETRIEVAL_K
+        with metrics.timed("retrieval"):
+            return self.flights.do((normalize_query(query), k), lambda: self._search([query], k)[0])
+
+    async def aretrieve(self, query: str, k: int = None) -> List[Document]:
+        """
+        Async retrieve(). Search is CPU-bound (embedding, FAISS, BM25), so it runs
+        on the event loop's thread pool and other questions keep being served.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, self.retrieve, query, k)
+
     def get_retriever(self):
         """Returns a retriever for the RAG chain."""
         if not self.vectorstore:
             self.load_vector_store()
-            
-        return self.vectorstore.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": config.RETRIEVAL_K}
-        )
+
+        return ManagerRetriever(manager=self, k=config.RETRIEVAL_K)
+
+
+class ManagerRetriever(BaseRetriever):
+    """LangChain retriever over VectorStoreManager.retrieve (search, optional rerank, query caches)."""
+
+    manager: Any
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.manager.retrieve(query, self.k)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return await self.manager.aretrieve(query, self.k)
+
 
 if __name__ == "__main__":
     # Standalone execution to build the index
     try:
         manager = VectorStoreManager()
-        manager.create_vector_store()
+        if "--migrate-legacy" in sys.argv:
+            manager.migrate_legacy_index()
+        else:
+            manager.create_vector_store()
         
         # Test search
         print("\nTesting Retrieval:")
@@ -107,4 +764,4 @@ if __name__ == "__main__":
             print(doc.page_content[:150] + "...")
             
     except Exception as e:
-        print(f"Error: {e}")
\ No newline at end of file
+        print(f"Error: {e}")